@@ -1,750 +1,212 @@
 import streamlit as st
-import yfinance as yf
 import pandas as pd
-import json
+import os
 import random
 import string
 import re
-import requests
-from datetime import datetime, timezone
-
-# === 設定 ===
-PREDICT_DAYS_DAILY = 20
-PREDICT_BARS_5M = 20
+from urllib.parse import quote
+from datetime import date
+from market_data import FETCH_PERIODS, load_bars, build_index, stale, rate_limited, main_source, sub_source
+from fetch_plan import FetchPlan, prefetch_later
+import company_master
+import http_client
+import frame_cache
+import game_results
+import tracing
+import rate_limit
+import prewarm
+from resample import resample_ohlcv
+import indicators
+from serialize import pack_payload
+from game_component import stock_game
+from game_data import PREDICT_DAYS_DAILY, slice_frame, round_window, build_game_data, build_sub_data
+from game_engine import MESSAGES
 
 st.set_page_config(page_title="株トレードゲーム", layout="wide")
 
-# === メッセージリスト定義 ===
-MESSAGES = {
-    "god": [
-        "未来から来たんですか？", "SECが監視を始めました。", "天才現る。", "バフェットが電話番号を知りたがっています。", "その透視能力、カジノでは使わないで。", "全知全能ですか？"
-    ],
-    "pro": [
-        "素晴らしい！", "目をつぶって発注しても勝てそう。", "働いたら負けですね。", "ウォール街がヘッドハントに来ます。", "完璧な読み。", "芸術的なトレード。"
-    ],
-    "normal": [
-        "コイントスと同じ。", "サルのダーツ投げレベル。", "凡人。", "AIに仕事奪われますよ。", "記憶に残らないトレード。", "プラマイゼロ。"
-    ],
-    "bad": [
-        "養分乙。", "引退をおすすめします。", "画面逆さま？", "勉強代にしては高い。", "定期預金にしましょう。", "アルゴのカモ。"
-    ],
-    "disaster": [
-        "逆にすごい！", "全人類への逆指標。", "PC電源入ってます？", "逆張りすれば億万長者。", "呼吸するように損してますね。", "お祓いに行きましょう。"
-    ]
-}
+# === 計測 ===
+# ページごとに各段階の時間を記録する。?debug=1（または STOCK_DEBUG=1）で画面下部に表示、
+# STOCK_METRICS_PORT を指定すると Prometheus 形式で /metrics を公開
+page_trace = tracing.start_trace("page")
+DEBUG = os.environ.get("STOCK_DEBUG") == "1" or st.query_params.get("debug") == "1"
+if os.environ.get("STOCK_METRICS_PORT"):
+    tracing.serve_metrics(int(os.environ["STOCK_METRICS_PORT"]))
+
+@st.cache_resource
+def get_company_master():
+    # 上場銘柄マスタ（プロセス内で1回だけ読み込む）。ファイルが無ければ None（Yahooへのスクレイピングにフォールバック）
+    return company_master.load()
 
+@tracing.traced(cached=True)
 def get_japanese_name(ticker):
+    # 成功は1日、見つからなかった場合（コードをそのまま返す）は短時間だけ覚えておく
+    return http_client.memoize(("name", ticker), lambda: lookup_japanese_name(ticker), ttl=86400)
+
+def lookup_japanese_name(ticker):
+    tracing.miss()
     code_only = ticker.replace('.T', '')
-    url = f"https://finance.yahoo.co.jp/quote/{code_only}.T"
-    try:
-        headers = {"User-Agent": "Mozilla/5.0"}
-        res = requests.get(url, headers=headers, timeout=3)
-        res.encoding = res.apparent_encoding
-        if res.status_code == 200:
-            match = re.search(r'<title>(.*?)【', res.text)
-            if match: return match.group(1).strip()
-    except: pass
+    master = get_company_master()
+    if master is not None:
+        name = master.name(code_only)
+        if name: return name, None
+    text, err = http_client.fetch_text(f"https://finance.yahoo.co.jp/quote/{code_only}.T")
+    if text:
+        match = re.search(r'<title>(.*?)【', text)
+        if match: return match.group(1).strip(), None
+    if not rate_limit.acquire(rate_limit.YF_HOST): return ticker, "混雑のため銘柄名の取得を見送りました"
+    import yfinance as yf
     try:
         t = yf.Ticker(ticker)
-        return t.info.get('longName', ticker)
-    except: return ticker
+        return t.info.get('longName', ticker), None
+    except Exception as e:
+        if rate_limited(e): rate_limit.throttled(rate_limit.YF_HOST)
+        return ticker, f"銘柄名取得エラー: {e}"
 
-@st.cache_data(ttl=3600)
+# 足データ・指標は frame_cache（メモリ上限付き LRU）に載せ、全セッションでコピーせずに共有する
+# （STOCK_CACHE_MB で予算を指定。返ってくる表に列を足してもキャッシュ側は変わらない）
+@tracing.traced(cached=True)
+@frame_cache.cached(ttl=3600, fail_ttl=60)
 def fetch_raw_data(ticker, period, interval):
-    try:
-        df = yf.download(ticker, period=period, interval=interval, progress=False, auto_adjust=False)
-    except Exception as e: return None, f"エラー: {e}"
+    # ローカル保存データ + 差分取得（market_data.load_bars）。キャッシュ切れでも全期間の再取得はしない
+    # 取得を見送って古い保存データで代用したときは、これを使う表も含めて 60 秒で取り直す
+    tracing.miss()
+    df, err = load_bars(ticker, period, interval)
+    if df is not None and stale(ticker, interval): frame_cache.short_lived()
+    return df, err
+
+@tracing.traced(cached=True)
+@frame_cache.cached(ttl=3600, fail_ttl=60)
+def fetch_bars(ticker, interval, source):
+    # source の足を取得し、interval が異なればローカルで集約する（週足・月足・3分足など）
+    tracing.miss()
+    df, err = fetch_raw_data(ticker, FETCH_PERIODS[source], source)
+    if err or source == interval: return df, err
+    return resample_ohlcv(df, interval), None
+
+@tracing.traced(cached=True)
+@frame_cache.cached(ttl=3600, fail_ttl=60)
+def compute_indicators(ticker, interval, source, specs):
+    # 指標は足データとは別にキャッシュする（同じ銘柄・足種・パラメータならセッションをまたいで再利用）
+    # 戻り値: (指標の df, err)
+    tracing.miss()
+    df, err = fetch_bars(ticker, interval, source)
+    if err: return None, err
+    return indicators.compute(df, specs), None
+
+# === 表示までの段階（取得 → 指標 → 切り出し → 整形） ===
+# 各段階をそれぞれの入力だけをキーにキャッシュする。日付やラウンドが変わったときにやり直すのは
+# メインの切り出し・整形と、サブチャートの切り詰め・形成中の足だけ（サブチャートの指標は全期間で1回）
+@tracing.traced(cached=True)
+@frame_cache.cached(ttl=3600, fail_ttl=60)
+def chart_frame(ticker, interval, source, labels):
+    # 足 + 指標を結合し、指標の先頭の欠損を落とした表。戻り値: (df, err)
+    tracing.miss()
+    df, err = fetch_bars(ticker, interval, source)
+    if err: return None, err
+    ind_df, err = compute_indicators(ticker, interval, source, indicators.preset_specs(labels))
+    if err: return None, err
+    return df.join(ind_df).dropna(), None
+
+@tracing.traced(cached=True)
+@frame_cache.cached(ttl=3600, fail_ttl=60)
+def get_availability(ticker, interval, source, labels):
+    # 日付選択用の索引 (dict, err)。ゲームが切り出すのと同じ chart_frame から作り、同じキーで覚える
+    # （ウィジェット操作の再実行は小さな dict を引くだけで、足データには触らない）。
+    # 保存データの索引は他のプロセス・prewarm.py・ingest.py が足した日を先に載せるが、
+    # このプロセスのキャッシュの表にはまだ無いことがあり、その日を選ぶと「選択日のデータなし」になるため
+    tracing.miss()
+    if not ticker: return None, None
+    df, err = chart_frame(ticker, interval, source, labels)
+    if err: return None, err
     if df.empty: return None, "データなし"
-    
-    if isinstance(df.columns, pd.MultiIndex):
-        try: df.columns = df.columns.get_level_values(0)
-        except: pass
-            
-    required = ['Open', 'High', 'Low', 'Close', 'Volume']
-    if not all(c in df.columns for c in required): return None, "データ不足"
-
-    if not isinstance(df.index, pd.DatetimeIndex):
-        df.index = pd.to_datetime(df.index)
-
-    # タイムゾーン処理: 日本時間に変換してTimeZone情報を削除（Naiveにする）
-    if df.index.tz is not None:
-        df.index = df.index.tz_convert('Asia/Tokyo').tz_localize(None)
-
-    return df, None
-
-def process_data(df, mode, selected_date_str=None):
-    df['MA5'] = df['Close'].rolling(5).mean()
-    df['MA25'] = df['Close'].rolling(25).mean()
-    df['MA75'] = df['Close'].rolling(75).mean()
-    df = df.dropna()
-
-    ctx_df = pd.DataFrame()
-    tgt_df = pd.DataFrame()
-
-    if mode == 'daily':
-        if len(df) < PREDICT_DAYS_DAILY + 50: return None, "データ不足"
-        
-        target_idx = -PREDICT_DAYS_DAILY # Default to latest
-        
-        if selected_date_str:
-            # 日付文字列から該当するIndexを探す (日付以前の直近の日)
-            try:
-                # 指定日以降のデータで一番古いものの位置を探すのが正確だが、
-                # indexは昇順なので、指定日以上(>=)の最初の要素
-                sel_ts = pd.Timestamp(selected_date_str).replace(tzinfo=None)
-                after_mask = df.index >= sel_ts
-                if after_mask.any():
-                    # その日の位置を取得
-                    # しかし、dfは全体なので、targetの開始位置はそこになる
-                    # つまり tgt_df = df.iloc[start_pos : start_pos+20]
-                    start_pos = list(after_mask).index(True)
-                    
-                    # 十分なcontextがあるか確認
-                    if start_pos < 50:
-                        return None, "開始日が古すぎます（過去データ不足）"
-                    if start_pos + PREDICT_DAYS_DAILY > len(df):
-                        # 未来すぎる場合は末尾に合わせる
-                        start_pos = len(df) - PREDICT_DAYS_DAILY
-                    
-                    ctx_df = df.iloc[:start_pos].tail(200) # 直近200本
-                    tgt_df = df.iloc[start_pos:] # JS側でページングするので残りは全部渡す
-                else:
-                    return None, "指定日のデータがありません"
-            except Exception as e:
-                return None, f"日付処理エラー: {e}"
-        else:
-            ctx_df = df.iloc[:-PREDICT_DAYS_DAILY]
-            tgt_df = df.iloc[-PREDICT_DAYS_DAILY:]
-
-    elif mode in ['5m', '3m', '1m']:
-        if not selected_date_str: return None, "日付未選択"
-        target_mask = df.index.strftime('%Y-%m-%d') == selected_date_str
-        tgt_df = df.loc[target_mask]
-        if tgt_df.empty: return None, "選択日のデータなし"
-        
-        # JS側でページングするため、ここでは全データを返す（リミットはJSで管理）
-        
-        cutoff_time = tgt_df.index[0]
-        ctx_df = df[df.index < cutoff_time].tail(200)
-
-    is_intraday = (mode in ['5m', '3m', '1m'])
-
-    def make_entry(t_idx, r, is_intraday):
-        if is_intraday:
-            # JSTの時刻をそのままあえてUTCとしてTimestamp化することで
-            # Lightweight Charts (デフォルトUTC表示) で見たときに
-            # 日本時間通りの時刻 (09:00など) が表示されるようにするトリック
-            # t_idx は Naive (JST時刻が入っている)
-            t_val = int(t_idx.replace(tzinfo=timezone.utc).timestamp())
-        else:
-            t_val = t_idx.strftime('%Y-%m-%d')
-
-        return {
-            "time": t_val,
-            "open": r['Open'], "high": r['High'], "low": r['Low'], "close": r['Close'],
-            "vol": r['Volume'],
-            "ma5": r['MA5'], "ma25": r['MA25'], "ma75": r['MA75']
-        }
-
-    ctx_data = {"c": [], "v": [], "m5": [], "m25": [], "m75": []}
-    tgt_data = {"c": [], "v": [], "m5": [], "m25": [], "m75": []}
-
-    for t, r in ctx_df.iterrows():
-        e = make_entry(t, r, is_intraday)
-        ctx_data["c"].append({"time": e["time"], "open": e["open"], "high": e["high"], "low": e["low"], "close": e["close"]})
-        ctx_data["v"].append({"time": e["time"], "value": e["vol"], "color": 'rgba(200, 200, 200, 0.4)'})
-        for m in ['m5', 'm25', 'm75']: ctx_data[m].append({"time": e["time"], "value": e["ma"+m[1:]]})
-
-    for t, r in tgt_df.iterrows():
-        e = make_entry(t, r, is_intraday)
-        tgt_data["c"].append({"time": e["time"], "open": e["open"], "high": e["high"], "low": e["low"], "close": e["close"]})
-        tgt_data["v"].append({"time": e["time"], "value": e["vol"], "color": 'rgba(200, 200, 200, 0.4)'})
-        for m in ['m5', 'm25', 'm75']: tgt_data[m].append({"time": e["time"], "value": e["ma"+m[1:]]})
-
-    return {"ctx": ctx_data, "tgt": tgt_data}, None
-
-def render_game_html(data, sub_data_map, ticker_name, ticker_code, mode, sub_mode_keys, sub_intervals):
-    json_data = json.dumps(data)
-    json_sub_map = json.dumps(sub_data_map)
-    json_msgs = json.dumps(MESSAGES)
-    json_sub_intervals = json.dumps(sub_intervals)
-    
-    # メインチャートの時間設定
-    time_scale_opts = "{ timeVisible: true, secondsVisible: false }"
-    if mode in ['5m', '3m', '1m']:
-        time_scale_opts = """{
-            timeVisible: true, 
-            secondsVisible: false,
-            tickMarkFormatter: (time, tickMarkType, locale) => {
-                const d = new Date(time * 1000);
-                return d.getUTCHours().toString().padStart(2,'0') + ':' + d.getUTCMinutes().toString().padStart(2,'0');
-            }
-        }"""
-
-    # サブチャート切り替え用オプションHTML
-    # sub_mode_keys = ["日足", "週足"] or ["週足", "月足"]
-    # 初期選択は keys[0] とする
-    options_html = ""
-    for k in sub_mode_keys:
-        options_html += f'<option value="{k}">{k}</option>'
-
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <script src="https://unpkg.com/lightweight-charts@3.8.0/dist/lightweight-charts.standalone.production.js"></script>
-        <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;600;800&display=swap" rel="stylesheet">
-        <style>
-            body {{ margin: 0; padding: 0; background: #0e1117; font-family: 'Inter', sans-serif; }}
-            .game-container {{
-                background: #1a1a1a; color: #f3f4f6; padding: 20px; border-radius: 16px;
-                width: 100%; max-width: 900px; margin: 0 auto; box-sizing: border-box;
-                box-shadow: 0 10px 25px rgba(0,0,0,0.5);
-            }}
-            .header {{
-                display: flex; justify-content: space-between; align-items: flex-end;
-                margin-bottom: 20px; border-bottom: 1px solid #333; padding-bottom: 15px;
-            }}
-            .ticker-info {{ display: flex; flex-direction: column; }}
-            .ticker-name {{ font-size: 24px; font-weight: 800; color: #ffffff; line-height: 1.2; }}
-            .ticker-code {{ font-size: 14px; color: #9ca3af; font-family: monospace; font-weight: 400; margin-top: 4px; }}
-            .mode-badge {{ display: inline-block; background: #3b82f6; color: white; font-size: 10px; padding: 2px 6px; border-radius: 4px; margin-left: 8px; vertical-align: middle; }}
-            
-            .stats-box {{ font-size: 14px; color: #9ca3af; display: flex; gap: 15px; align-items: center; }}
-            .stat-val {{ font-weight: 800; font-size: 18px; font-family: monospace; }}
-            .win-col {{ color: #34d399; }} .lose-col {{ color: #f87171; }}
-
-            .chart-wrapper {{
-                position: relative; width: 100%; height: 400px;
-                border-radius: 12px; overflow: hidden; border: 1px solid #333; background: #222;
-                margin-bottom: 20px;
-            }}
-            .sub-chart-wrapper {{
-                position: relative; width: 100%; height: 250px;
-                border-radius: 12px; overflow: hidden; border: 1px solid #333; background: #222;
-                margin-top: 10px;
-            }}
-            .price-label-box {{
-                position: absolute; top: 20px; left: 50%; transform: translateX(-50%);
-                background: rgba(30,30,30,0.85); border: 1px solid rgba(255,215,0,0.5);
-                padding: 8px 20px; border-radius: 8px;
-                text-align: center; pointer-events: none; z-index: 20; display: none;
-            }}
-            .price-label-title {{ color: #FBBF24; font-size: 11px; font-weight: 600; letter-spacing: 1px; margin-bottom: 2px; }}
-            .price-label-val {{ color: #FFD700; font-size: 24px; font-weight: 900; font-family: monospace; line-height: 1; }}
-
-            .overlay-anim {{
-                position: absolute; top: 50%; left: 50%; transform: translate(-50%, -50%);
-                font-size: 100px; font-weight: 900; opacity: 0; pointer-events: none; z-index: 30;
-                text-shadow: 0 5px 15px rgba(0,0,0,0.5); white-space: nowrap;
-            }}
-
-            .btn-group {{ display: flex; gap: 12px; margin-top: 20px; width: 100%; }}
-            .game-btn {{
-                flex: 1; padding: 16px; border: none; border-radius: 12px;
-                font-weight: 800; font-size: 16px; cursor: pointer; transition: all 0.2s; color: #fff;
-            }}
-            .game-btn:hover {{ filter: brightness(1.1); transform: translateY(-2px); }}
-            .game-btn:active {{ transform: translateY(0); filter: brightness(0.95); }}
-            .btn-buy {{ background: linear-gradient(135deg, #34d399 0%, #10b981 100%); }}
-            .btn-sell {{ background: linear-gradient(135deg, #f87171 0%, #ef4444 100%); }}
-            .btn-skip {{ background: #374151; color: #d1d5db; flex: 0.4; }}
-
-            .modal-overlay {{
-                display: none; position: absolute; inset: 0;
-                background: rgba(26,26,26,0.95); backdrop-filter: blur(5px);
-                flex-direction: column; justify-content: center; align-items: center; z-index: 100;
-                border-radius: 16px;
-            }}
-            .modal-content {{ background: #27272a; padding: 40px; border-radius: 20px; text-align: center; border: 1px solid #3f3f46; max-width: 90%; }}
-            .result-score {{ font-size: 60px; font-weight: 900; margin: 0 0 20px 0; line-height: 1; }}
-            .result-msg {{ font-size: 16px; color: #d1d5db; margin: 0 0 30px 0; line-height: 1.6; font-weight: 600; }}
-            .modal-btn {{ padding: 12px 30px; background: #3b82f6; color: white; border: none; border-radius: 30px; cursor: pointer; font-size: 16px; font-weight: 800; }}
-
-            .sub-chart-controls {{
-                position: absolute; top: 10px; left: 10px; z-index: 200;
-            }}
-            .sub-select {{
-                background: rgba(40,40,40,0.9); color: #e5e7eb; border: 1px solid #555;
-                padding: 4px 8px; border-radius: 6px; font-size: 12px; outline: none; cursor: pointer;
-            }}
-            
-            @media (max-width: 600px) {{
-                .game-container {{ padding: 10px; }}
-                .header {{ flex-direction: column; align-items: flex-start; gap: 10px; margin-bottom: 10px; }}
-                .stats-box {{ width: 100%; justify-content: space-between; font-size: 12px; }}
-                .stat-val {{ font-size: 16px; }}
-                
-                .chart-wrapper {{ height: 300px; margin-bottom: 10px; }}
-                .sub-chart-wrapper {{ height: 150px; margin-top: 5px; }}
-                
-                .btn-group {{ margin-top: 10px; gap: 8px; }}
-                .game-btn {{ padding: 12px; font-size: 14px; }}
-                
-                .price-label-val {{ font-size: 20px; }}
-                .overlay-anim {{ font-size: 60px; }}
-            }}
-        </style>
-    </head>
-    <body>
-        <div id="game-wrap" class="game-container">
-            <div class="header">
-                <div class="ticker-info">
-                    <div style="display:flex; align-items:center;">
-                        <span class="ticker-name">{ticker_name}</span>
-                        <span class="mode-badge">{mode.upper()}</span>
-                    </div>
-                    <span class="ticker-code">{ticker_code}</span>
-                </div>
-                <div class="stats-box">
-                    <div>WIN: <span id="w-val" class="stat-val win-col">0</span></div>
-                    <div>LOSE: <span id="l-val" class="stat-val lose-col">0</span></div>
-                    <div style="margin-left: 10px; background: #333; padding: 4px 10px; border-radius: 6px;">
-                        REMAIN: <span id="r-val" class="stat-val" style="color: #fbbf24;">{len(data['tgt']['c'])}</span>
-                    </div>
-                </div>
-            </div>
-
-            <div class="chart-wrapper">
-                <div id="chart-area" style="width:100%; height:100%;"></div>
-                <div id="price-label" class="price-label-box">
-                    <div class="price-label-title">次の始値</div>
-                    <div id="price-val" class="price-label-val">----</div>
-                </div>
-                <div id="ov-anim" class="overlay-anim"></div>
-            </div>
-
-            <div class="sub-chart-wrapper">
-                <div class="sub-chart-controls">
-                    <select id="sub-chart-select" class="sub-select">
-                        {options_html}
-                    </select>
-                </div>
-                <div id="sub-chart-area" style="width:100%; height:100%;"></div>
-            </div>
-
-            <div class="btn-group">
-                <button id="btn-up" class="game-btn btn-buy">▲ BUY</button>
-                <button id="btn-skip" class="game-btn btn-skip">SKIP</button>
-                <button id="btn-down" class="game-btn btn-sell">▼ SELL</button>
-            </div>
-            
-            <div id="res-modal" class="modal-overlay">
-                <div class="modal-content">
-                    <div style="font-size:18px; font-weight:800; color:#a1a1aa; margin-bottom:10px;">ACCURACY RATE</div>
-                    <div id="score-val" class="result-score"></div>
-                    <div id="msg-val" class="result-msg"></div> 
-                    <div style="display:flex; gap:10px; justify-content:center; margin-top:20px;">
-                        <button id="btn-retry" class="modal-btn" style="background:#555;">もう一度</button>
-                        <button id="btn-next" class="modal-btn">次へ</button>
-                        <button onclick="document.getElementById('res-modal').style.display='none'" class="modal-btn" style="background:transparent; border:1px solid #555;">閉じる</button>
-                    </div>
-                </div>
-            </div>
-        </div>
-
-        <script>
-        (function(){{
-            const d = {json_data};
-            const subDMap = {json_sub_map}; 
-            const subIntervals = {json_sub_intervals};
-            const MSGS = {json_msgs};
-            const ROUND_LEN = 20;
-
-            let startIdx = 0; 
-            let idx = 0;      
-            let w = 0, l = 0;
-            let ac = null; let priceLine = null;
-            let currentSubKey = null;
-
-            // === Main Chart ===
-            const chart = LightweightCharts.createChart(document.getElementById('chart-area'), {{
-                layout: {{ backgroundColor: '#222', textColor: '#9ca3af', fontFamily: "'Inter', sans-serif" }},
-                grid: {{ vertLines: {{ visible: false }}, horzLines: {{ visible: true, color: '#333' }} }},
-                timeScale: {time_scale_opts},
-                rightPriceScale: {{ borderColor: '#333', scaleMargins: {{ top: 0.1, bottom: 0.2 }} }},
-                crosshair: {{ vertLine: {{ color: '#555', labelBackgroundColor: '#555' }}, horzLine: {{ color: '#555', labelBackgroundColor: '#555' }} }}
-            }});
-
-            const sM75 = chart.addLineSeries({{ color: '#a855f7', lineWidth: 1, crosshairMarkerVisible: false, lastValueVisible: false, priceLineVisible: false, priceScaleId: 'right' }});
-            const sM25 = chart.addLineSeries({{ color: '#34d399', lineWidth: 1, crosshairMarkerVisible: false, lastValueVisible: false, priceLineVisible: false, priceScaleId: 'right' }});
-            const sM5  = chart.addLineSeries({{ color: '#facc15', lineWidth: 1, crosshairMarkerVisible: false, lastValueVisible: false, priceLineVisible: false, priceScaleId: 'right' }});
-            
-            const sC = chart.addCandlestickSeries({{ 
-                upColor: '#10b981', downColor: '#f43f5e', 
-                borderUpColor: '#10b981', borderDownColor: '#f43f5e', 
-                wickUpColor: '#10b981', wickDownColor: '#f43f5e',
-                lastValueVisible: false, priceLineVisible: false 
-            }});
-            
-            const sNextOpen = chart.addCandlestickSeries({{ 
-                upColor: '#FFD700', downColor: '#FFD700', borderUpColor: '#FFD700', borderDownColor: '#FFD700', wickUpColor: '#FFD700', wickDownColor: '#FFD700',
-                lastValueVisible: false, priceLineVisible: false 
-            }});
-            
-            const sV = chart.addHistogramSeries({{ 
-                priceFormat: {{ type: 'volume' }}, priceScaleId: '', scaleMargins: {{ top: 0.8, bottom: 0 }},
-                lastValueVisible: false, priceLineVisible: false 
-            }});
-
-            // === Sub Chart ===
-            const subChart = LightweightCharts.createChart(document.getElementById('sub-chart-area'), {{
-                layout: {{ backgroundColor: '#222', textColor: '#9ca3af', fontFamily: "'Inter', sans-serif" }},
-                grid: {{ vertLines: {{ visible: false }}, horzLines: {{ visible: true, color: '#333' }} }},
-                rightPriceScale: {{ borderColor: '#333' }},
-                timeScale: {{ borderVisible: false }}
-            }});
-            
-            const ssM75 = subChart.addLineSeries({{ color: '#a855f7', lineWidth: 1, crosshairMarkerVisible: false, lastValueVisible: false, priceLineVisible: false }});
-            const ssM25 = subChart.addLineSeries({{ color: '#34d399', lineWidth: 1, crosshairMarkerVisible: false, lastValueVisible: false, priceLineVisible: false }});
-            const ssM5  = subChart.addLineSeries({{ color: '#facc15', lineWidth: 1, crosshairMarkerVisible: false, lastValueVisible: false, priceLineVisible: false }});
-            
-            const ssC = subChart.addCandlestickSeries({{ 
-                upColor: '#10b981', downColor: '#f43f5e', 
-                borderUpColor: '#10b981', borderDownColor: '#f43f5e', 
-                wickUpColor: '#10b981', wickDownColor: '#f43f5e'
-            }});
-
-            function loadSubChart(key, currentMainTime, currentMainCData) {{
-                currentSubKey = key;
-                const sd = subDMap[key];
-                if (!sd) return;
-                
-                const intervalSec = subIntervals[key];
-                
-                let filteredC = [], filteredM5 = [], filteredM25 = [], filteredM75 = [];
-                
-                if (intervalSec > 0 && currentMainTime && currentMainCData) {{
-                    // Intraday logic (Times are Unix Timestamps)
-                    // 1. Identify valid historical range (Completed bars)
-                    
-                    // Current forming bucket start time
-                    // Assuming intervalSec (300) is clean divisor usually, but usually timestamps are aligned to 00:00.
-                    // 5m bars are 0, 300, 600...
-                    const bucketStart = Math.floor(currentMainTime / intervalSec) * intervalSec;
-                    
-                    // Filter historical: valid if bar.time < bucketStart
-                    // We trust subDMap contains correct finalized bars.
-                    const checkHist = (t) => t < bucketStart;
-
-                    for(let i=0; i<sd.c.length; i++) {{
-                        if(checkHist(sd.c[i].time)) {{
-                            filteredC.push(sd.c[i]);
-                            filteredM5.push(sd.m5[i]);
-                            filteredM25.push(sd.m25[i]);
-                            filteredM75.push(sd.m75[i]);
-                        }}
-                    }}
-                    
-                    // 2. Synthesize Forming Candle
-                    // Find all main candles that belong to [bucketStart, currentMainTime]
-                    
-                    let formO=null, formH=-Infinity, formL=Infinity, formC=null, formVol=0;
-                    let found = false;
-                    
-                    for (let i = currentMainCData.length - 1; i >= 0; i--) {{
-                        const c = currentMainCData[i];
-                        if (c.time < bucketStart) break; // Finished current bucket
-                        
-                        // Accumulate (order is reverse loop, so be careful with Open/Close)
-                        if (!found) {{ formC = c.close; found=true; }} // Last one we see is Close
-                        formO = c.open; // Keep updating Open (will end up being the earliest)
-                        formH = Math.max(formH, c.high);
-                        formL = Math.min(formL, c.low);
-                    }}
-                    
-                    if (found) {{
-                        const formCandle = {{ time: bucketStart, open: formO, high: formH, low: formL, close: formC }};
-                        filteredC.push(formCandle);
-                        
-                        // Note: We don't synthesize MAs for forming candle easily. 
-                        // Just stop MAs at previous bar.
-                    }}
-                    
-                }} else if (currentMainTime) {{
-                     // Daily/Weekly mode (Strings) - fallback to simple logic
-                     const check = (t) => {{
-                         if (typeof currentMainTime === 'number') return true; 
-                         return t < currentMainTime;
-                     }};
-                     for(let i=0; i<sd.c.length; i++) {{
-                        if(check(sd.c[i].time)) {{
-                            filteredC.push(sd.c[i]);
-                            filteredM5.push(sd.m5[i]);
-                            filteredM25.push(sd.m25[i]);
-                            filteredM75.push(sd.m75[i]);
-                        }}
-                    }}
-                }} else {{
-                    // Init view
-                     filteredC = sd.c; filteredM5=sd.m5; filteredM25=sd.m25; filteredM75=sd.m75;
-                }}
-
-                ssC.setData(filteredC);
-                ssM5.setData(filteredM5);
-                ssM25.setData(filteredM25);
-                ssM75.setData(filteredM75);
-                
-                if (!currentMainTime) {{
-                    const total = filteredC.length;
-                    if (total > 0) {{
-                        const fromIdx = Math.max(0, total - 100);
-                        subChart.timeScale().setVisibleLogicalRange({{ from: fromIdx, to: total + 4 }});
-                    }} else {{
-                        subChart.timeScale().fitContent();
-                    }}
-                }}
-            }}
-            
-            // 下部チャート切り替え event
-            const sel = document.getElementById('sub-chart-select');
-            if(sel) {{
-                 sel.onchange = (e) => {{
-                     // Get current main info
-                     let curT = null;
-                     let curCData = null;
-                     if (idx < d.tgt.c.length) {{
-                         const curData = (idx > 0) ? d.tgt.c[idx-1] : d.ctx.c[d.ctx.c.length-1];
-                         curT = curData.time;
-                         // Ideally we need full cData access here, but this is an edge case (switch mid-game)
-                         // We can grab global cData from render scope? No it's local.
-                         // We can reconstruct roughly or wait for next render.
-                         // Let's pass null cData forces static view updates on next step.
-                         // Or reconstructed:
-                         const currentFull = [...d.ctx.c, ...d.tgt.c.slice(0, idx)];
-                         curCData = currentFull;
-                     }}
-                     loadSubChart(e.target.value, curT, curCData);
-                 }};
-                 // 初期表示
-                 loadSubChart(sel.value);
-            }}
-
-            // Main Chart Functions
-            function updateNextOpenDisplay() {{
-                if (idx >= d.tgt.c.length) {{
-                    sNextOpen.setData([]);
-                    document.getElementById('price-label').style.display = 'none';
-                    if (priceLine) {{ sC.removePriceLine(priceLine); priceLine = null; }}
-                    return;
-                }}
-                const nextData = d.tgt.c[idx];
-                document.getElementById('price-val').innerText = nextData.open.toLocaleString();
-                document.getElementById('price-label').style.display = 'block';
-                if (priceLine) sC.removePriceLine(priceLine);
-                priceLine = sC.createPriceLine({{ price: nextData.open, color: '#FFD700', lineWidth: 1, lineStyle: 2, axisLabelVisible: false }});
-                sNextOpen.setData([{{ time: nextData.time, open: nextData.open, high: nextData.open, low: nextData.open, close: nextData.open }}]);
-            }}
-
-            function render(i) {{
-                const cData = [...d.ctx.c, ...d.tgt.c.slice(0, i)];
-                sC.setData(cData);
-                sV.setData([...d.ctx.v, ...d.tgt.v.slice(0, i)]);
-                sM5.setData([...d.ctx.m5, ...d.tgt.m5.slice(0, i)]);
-                sM25.setData([...d.ctx.m25, ...d.tgt.m25.slice(0, i)]);
-                sM75.setData([...d.ctx.m75, ...d.tgt.m75.slice(0, i)]);
-                updateNextOpenDisplay();
-                
-                // Update Sub Chart
-                if (currentSubKey) {{
-                    // Current visible main candle time is the LAST one in cData
-                    if (cData.length > 0) {{
-                        const lastMain = cData[cData.length - 1];
-                        loadSubChart(currentSubKey, lastMain.time, cData);
-                    }}
-                }}
-            }}
-
-            function initGame(baseIdx) {{
-                startIdx = baseIdx;
-                idx = startIdx;
-                w = 0; l = 0;
-                
-                currentSubKey = document.getElementById('sub-chart-select').value;
-                
-                // Initial render
-                // Identify context end time
-                const ctxEnd = d.ctx.c.length > 0 ? d.ctx.c[d.ctx.c.length-1].time : null;
-                // If starting mid-game (idx>0), correct time is d.tgt.c[idx-1].time
-                let initTime = ctxEnd;
-                if (idx > 0) {{
-                    initTime = d.tgt.c[idx-1].time;
-                }}
-                
-                const cDataInit = [...d.ctx.c, ...d.tgt.c.slice(0, idx)];
-                if (cDataInit.length > 0) {{
-                     initTime = cDataInit[cDataInit.length - 1].time;
-                }}
-                
-                loadSubChart(currentSubKey, initTime, cDataInit);
-
-                document.getElementById('w-val').innerText = '0';
-                document.getElementById('l-val').innerText = '0';
-                document.getElementById('r-val').innerText = ROUND_LEN;
-                document.getElementById('res-modal').style.display = 'none';
-
-                render(idx);
-                // 範囲調整
-                const totalVisible = d.ctx.c.length + idx;
-                chart.timeScale().setVisibleLogicalRange({{ from: totalVisible - 50, to: totalVisible + 5 }});
-            }}
-
-            initGame(0);
-
-            function beep(t) {{
-                try {{
-                    if(!ac) ac=new(window.AudioContext||window.webkitAudioContext)();
-                    if(ac.state==='suspended') ac.resume();
-                    const o=ac.createOscillator(), g=ac.createGain();
-                    o.connect(g); g.connect(ac.destination);
-                    const n=ac.currentTime;
-                    if(t==='w') {{ o.freq.setValueAtTime(880,n); o.freq.expRampToValueAtTime(1760,n+.1); g.gain.setValueAtTime(.1,n); g.gain.linRampToValueAtTime(0,n+.4); }}
-                    else if(t==='l') {{ o.type='sawtooth'; o.freq.setValueAtTime(150,n); g.gain.setValueAtTime(.1,n); g.gain.linRampToValueAtTime(0,n+.3); }}
-                    else {{ o.type='square'; o.freq.setValueAtTime(500,n); g.gain.setValueAtTime(.05,n); g.gain.linRampToValueAtTime(0,n+.1); }}
-                    o.start(n); o.stop(n+(t==='w'?.4:t==='l'?.3:.1));
-                }} catch(e){{}}
-            }}
-
-            async function animateCandle(c) {{
-                const sleep = ms => new Promise(r => setTimeout(r, ms));
-                const steps = 8; 
-                const wait = 15;
-                const isYang = c.close >= c.open;
-                
-                const upd = (o, h, l, cl) => sC.update({{ time: c.time, open: o, high: h, low: l, close: cl }});
-
-                if (isYang) {{
-                    // O -> L
-                    for(let i=1; i<=steps; i++) {{
-                        const p = c.open + (c.low - c.open) * (i/steps);
-                        upd(c.open, c.open, p, p);
-                        await sleep(wait);
-                    }}
-                    // L -> H
-                    for(let i=1; i<=steps; i++) {{
-                        const p = c.low + (c.high - c.low) * (i/steps);
-                        // p is current price. H is max(open, p), L is low
-                        let curH = Math.max(c.open, p);
-                        upd(c.open, curH, c.low, p);
-                        await sleep(wait);
-                    }}
-                    // H -> C
-                    for(let i=1; i<=steps; i++) {{
-                        const p = c.high + (c.close - c.high) * (i/steps);
-                        upd(c.open, c.high, c.low, p);
-                        await sleep(wait);
-                    }}
-                }} else {{
-                    // O -> H
-                    for(let i=1; i<=steps; i++) {{
-                        const p = c.open + (c.high - c.open) * (i/steps);
-                        upd(c.open, p, c.open, p);
-                        await sleep(wait);
-                    }}
-                    // H -> L
-                    for(let i=1; i<=steps; i++) {{
-                        const p = c.high + (c.low - c.high) * (i/steps);
-                        // p is current price. L is min(open, p)
-                        let curL = Math.min(c.open, p);
-                        upd(c.open, c.high, curL, p);
-                        await sleep(wait);
-                    }}
-                    // L -> C
-                    for(let i=1; i<=steps; i++) {{
-                        const p = c.low + (c.close - c.low) * (i/steps);
-                        upd(c.open, c.high, c.low, p);
-                        await sleep(wait);
-                    }}
-                }}
-            }}
-
-            function setBtns(disabled) {{
-                document.getElementById('btn-up').disabled = disabled;
-                document.getElementById('btn-skip').disabled = disabled;
-                document.getElementById('btn-down').disabled = disabled;
-                if(disabled) {{
-                    document.getElementById('btn-up').style.opacity = 0.5;
-                    document.getElementById('btn-skip').style.opacity = 0.5;
-                    document.getElementById('btn-down').style.opacity = 0.5;
-                }} else {{
-                    document.getElementById('btn-up').style.opacity = 1;
-                    document.getElementById('btn-skip').style.opacity = 1;
-                    document.getElementById('btn-down').style.opacity = 1;
-                }}
-            }}
-
-            async function playTurn(act) {{
-                if(idx >= d.tgt.c.length) return;
-                setBtns(true);
-
-                const next=d.tgt.c[idx];
-                const isUp=next.close>=next.open;
-                let txt='SKIP', col='#9ca3af', snd='s';
-                
-                if(act!=='skip') {{
-                    const win=(act==='up'&&isUp)||(act==='down'&&!isUp);
-                    if(win) {{ w++; txt='⭕'; col='#34d399'; snd='w'; }}
-                    else {{ l++; txt='❌'; col='#f87171'; snd='l'; }}
-                }}
-                beep(snd);
-
-                const ov=document.getElementById('ov-anim');
-                ov.innerText=txt; ov.style.color=col;
-                ov.style.transition='none'; ov.style.opacity=1; ov.style.transform='translate(-50%,-50%) scale(1.2)';
-                requestAnimationFrame(()=>{{
-                    setTimeout(()=>{{ ov.style.transition='all 1s ease-out'; ov.style.opacity=0; ov.style.transform='translate(-50%,-50%) scale(0.8)'; }}, 50);
-                }});
-
-                if (act !== 'skip') {{
-                   await animateCandle(next);
-                }}
-
-                document.getElementById('w-val').innerText=w;
-                document.getElementById('l-val').innerText=l;
-                
-                idx++;
-                render(idx);
-                
-                // 残り回数計算: 現在のラウンド終了まで何回か
-                const playedInRound = idx - startIdx;
-                document.getElementById('r-val').innerText = ROUND_LEN - playedInRound;
-
-                const totalVisible = d.ctx.c.length + idx;
-                chart.timeScale().setVisibleLogicalRange({{ from: totalVisible - 50, to: totalVisible + 5 }});
-                
-                setBtns(false);
-
-                // ラウンド終了判定
-                if(playedInRound >= ROUND_LEN || idx >= d.tgt.c.length) {{
-                    setTimeout(()=>{{
-                        const total = w + l;
-                        const rate = total ? Math.round(w / total * 100) : 0;
-                        const sEl = document.getElementById('score-val');
-                        document.getElementById('msg-val').innerText = MSGS[rate >= 80 ? 'god' : rate >= 60 ? 'pro' : rate >= 40 ? 'normal' : rate >= 20 ? 'bad' : 'disaster'][0];
-                        sEl.innerText = rate + '%';
-                        sEl.style.color = rate >= 50 ? '#34d399' : '#f87171';
-                        
-                        // ボタン制御
-                        const hasNext = (idx < d.tgt.c.length);
-                        document.getElementById('btn-next').style.display = hasNext ? 'inline-block' : 'none';
-                        
-                        document.getElementById('res-modal').style.display='flex';
-                    }}, 1000);
-                }}
-            }}
-
-            document.getElementById('btn-up').onclick = () => playTurn('up');
-            document.getElementById('btn-skip').onclick = () => playTurn('skip');
-            document.getElementById('btn-down').onclick = () => playTurn('down');
-
-            document.getElementById('btn-retry').onclick = () => initGame(startIdx);
-            document.getElementById('btn-next').onclick = () => initGame(idx); // 現在のidxから開始
-        }})();
-        </script>
-    </body>
-    </html>
-    """
-    return html
+    return build_index(df.index), None
+
+@tracing.traced(cached=True)
+@frame_cache.cached(ttl=3600, fail_ttl=60)
+def game_window(ticker, interval, source, labels, mode, date, round_no):
+    # ラウンド round_no の出題と、その手前までの足。戻り値: (ctx_df, tgt_df, 次のラウンドがあるか, err)
+    tracing.miss()
+    df, err = chart_frame(ticker, interval, source, labels)
+    if err: return None, None, False, err
+    ctx_df, tgt_df, err = slice_frame(df, mode, date)
+    if err: return None, None, False, err
+    return (*round_window(ctx_df, tgt_df, round_no), None)
+
+@tracing.traced(cached=True)
+@frame_cache.cached(ttl=3600, fail_ttl=60)
+def main_payload(ticker, interval, source, labels, mode, date, round_no):
+    # 戻り値: (pack_payload 済みのゲームデータ, 次のラウンドがあるか, err)
+    tracing.miss()
+    ctx_df, tgt_df, has_next, err = game_window(ticker, interval, source, labels, mode, date, round_no)
+    if err: return None, False, err
+    return pack_payload(build_game_data(ctx_df, tgt_df, mode, indicators.preset_lines(labels))), has_next, None
+
+@tracing.traced(cached=True)
+@frame_cache.cached(ttl=3600, fail_ttl=60)
+def sub_payloads(main_key, sub_items, mode, date, round_no, detail=()):
+    # 全サブチャートを game_data.build_sub_data で整形する（detail に含まれるものは古い履歴もまとめずに送る）
+    # 戻り値: (pack_payload 済みのサブチャート, pack_payload 済みの形成中の足, err)
+    tracing.miss()
+    ticker, main_interval, base, labels = main_key
+    # サブチャートは価格スケールの線のみ
+    sub_labels = tuple(k for k in labels if indicators.PRESETS[k][2] == 'price')
+    sub_lines = indicators.preset_lines(sub_labels)
+    ctx_df, tgt_df, _, err = game_window(*main_key, mode, date, round_no)
+    if err: return None, None, err
+    raw_df, err = fetch_bars(ticker, main_interval, base)
+    if err: return None, None, err
+
+    sub_map, forming, errors = {}, {}, []
+    for label, sub_int, source in sub_items:
+        s_df, err = chart_frame(ticker, sub_int, source, sub_labels)
+        if err:
+            errors.append(f"{label}: {err}")
+            continue
+        sub_map[label], forming[label] = build_sub_data(s_df, raw_df, ctx_df.index, tgt_df.index, sub_int, sub_lines,
+                                                        full=label in detail)
+    if errors: return None, None, "サブチャート取得エラー: " + ", ".join(errors)
+    return pack_payload(sub_map), pack_payload(forming), None
+
+# === 先温め（起動時・定期） ===
+# ウォッチリストの銘柄の足・指標（初期表示の指標）を、裏のスレッドで取得し直してプロセス内のキャッシュに載せる。
+# 期限前のエントリも refreshing() で作り直すので、定期の回ごとに新しい足（と日付選択の索引）に入れ替わる。
+# スレッドはこのスクリプトが最初に実行されたとき（最初のセッション）に起動する。
+# それより前に温めておくにはデプロイ時に python prewarm.py を実行する（prewarm.py）
+def prewarm_ticker(ticker):
+    errors = []
+    for interval in prewarm.INTERVALS:
+        with frame_cache.refreshing():
+            _, err = get_availability(ticker, interval, interval, indicators.DEFAULT_PRESETS)
+        if err: errors.append(f"{interval}: {err}")
+    return ", ".join(errors) or None
+
+prewarm.start(prewarm_ticker)
+
+# === ゲームの進行（フロントからのイベントを受け取る） ===
+# フロントはラウンド終了時に結果（各ターンの判断を含む）を、「次へ」で次のラウンドの要求を送ってくる。
+# サーバー側はラウンド番号を持ち、要求されたラウンドの足だけを渡す
+GAME_KEY = "stock_game"
+
+def game_state(game_id):
+    # 銘柄・モード・日付・指標が変わったら新しいゲームとして最初のラウンドから
+    gs = st.session_state.get("game_state")
+    if gs is None or gs["game"] != game_id:
+        gs = st.session_state["game_state"] = {"game": game_id, "round": 0, "results": [], "meta": {}, "detail": ()}
+    return gs
+
+def on_game_event():
+    ev = st.session_state.get(GAME_KEY)
+    gs = st.session_state.get("game_state")
+    # 前のゲームの画面から届いたものは捨てる
+    if not ev or gs is None or ev.get("game") != gs["game"]: return
+    if ev["type"] == "round":
+        result = dict(gs["meta"], **{k: ev.get(k) for k in ("round", "attempt", "win", "lose", "decisions")})
+        gs["results"].append(result)
+        gs["error"] = game_results.record(result)
+    elif ev["type"] == "next":
+        gs["round"] = ev["round"] + 1
+    elif ev["type"] == "detail":
+        gs["detail"] = tuple(sorted(set(gs["detail"]) | {ev.get("chart")}))
 
 # === UI (Main Area) ===
 st.markdown("""
@@ -755,15 +217,17 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # === 検索等のヘルパー関数 ===
-@st.cache_data(ttl=3600)
 def search_yahoo_jp(query):
+    # 失敗（空の結果）は短時間だけ覚えておき、次の入力で再試行する
+    return http_client.memoize(("search", query), lambda: scrape_yahoo_search(query))
+
+def scrape_yahoo_search(query):
     # コードそのものなら検索不要だが、ここでは名前に対応
-    url = f"https://finance.yahoo.co.jp/search/?query={query}"
-    headers = {"User-Agent": "Mozilla/5.0"}
+    text, err = http_client.fetch_text(f"https://finance.yahoo.co.jp/search/?query={quote(query)}")
+    if err: return [], err
+    from bs4 import BeautifulSoup
     try:
-        r = requests.get(url, headers=headers)
-        r.raise_for_status()
-        soup = BeautifulSoup(r.content, "html.parser")
+        soup = BeautifulSoup(text, "html.parser")
         
         candidates = []
         seen = set()
@@ -788,10 +252,16 @@ def search_yahoo_jp(query):
                 if code not in seen:
                     candidates.append(f"{code} : {name}")
                     seen.add(code)
-        
-        return candidates
+
+        return candidates, (None if candidates else "候補なし")
     except Exception as e:
-        return []
+        return [], f"検索結果の解析エラー: {e}"
+
+def search_companies(query):
+    # マスタがあればローカルの索引だけで引く（ネットワークに出ない）
+    master = get_company_master()
+    if master is None: return search_yahoo_jp(query)
+    return [f"{code}.T : {name}" for code, name in master.search(query)]
 
 st.title("💹 株トレードゲーム")
 
@@ -814,7 +284,7 @@ with c1:
         ticker_input = search_input
     # それ以外（4桁数字、文字など） -> 全部検索にかける
     elif search_input:
-        candidates = search_yahoo_jp(search_input)
+        candidates = search_companies(search_input)
         if candidates:
             # 選択肢を表示（最初の要素をデフォルトに）
             selected_cand = st.selectbox("候補を選択", candidates)
@@ -832,50 +302,71 @@ with c1:
 
 with c2:
     mode = st.radio("モード", ["日足", "5分足", "3分足", "1分足"], horizontal=True, label_visibility="collapsed")
+    indicator_labels = tuple(st.multiselect("インジケーター", list(indicators.PRESETS), default=list(indicators.DEFAULT_PRESETS)))
 
 # サブチャート用設定（選択肢定義のみ）
 sub_mode_map = {}
 
 # モード判定
+# base_interval: yfinance から実際に取得する足。3分足・サブチャートの5分足は1分足から、
+# 週足・月足は日足から集約するので、1ページあたりの取得は最大2種類（base + 日足）で済む
 if mode == "日足":
     game_mode = 'daily'
+    main_interval = "1d"
     sub_mode_map = {"週足": "1wk", "月足": "1mo"}
 elif mode == "5分足":
     game_mode = '5m'
+    main_interval = "5m"
     sub_mode_map = {"日足": "1d", "週足": "1wk"}
 elif mode == "3分足":
     game_mode = '3m'
+    main_interval = "3m"
     sub_mode_map = {"5分足": "5m", "日足": "1d", "週足": "1wk"}
 else: # 1分足
     game_mode = '1m'
+    main_interval = "1m"
     sub_mode_map = {"5分足": "5m", "日足": "1d", "週足": "1wk"}
+base_interval = main_source(main_interval)
+
+def source_interval(interval):
+    # 分足は現在モードの取得足から、日足以上は日足から作る
+    return sub_source(interval, base_interval)
+
+# 先読み: 日付選択・メイン・サブチャート・銘柄名の取得を重複を除いてまとめて並列に実行する
+# （結果は各関数のキャッシュに載るので、以降の呼び出しはキャッシュヒットになる）
+# 上流が混んでいるときはメインチャート（日付選択も同じデータ）を先に、サブチャート・銘柄名を後に取る
+if ticker_input:
+    plan = FetchPlan()
+    plan.add(fetch_raw_data, ticker_input, FETCH_PERIODS[base_interval], base_interval, priority=rate_limit.MAIN)
+    for sub_int in sub_mode_map.values():
+        src = source_interval(sub_int)
+        plan.add(fetch_raw_data, ticker_input, FETCH_PERIODS[src], src, priority=rate_limit.SUB)
+    plan.add(get_japanese_name, ticker_input, priority=rate_limit.SUB)
+    with st.spinner("データを取得中..."), tracing.span("prefetch", jobs=len(plan.calls)):
+        plan.run()
 
 # 日付選択（イントラデイ or 日足）
+# 選択肢はゲームが切り出すのと同じ chart_frame（キャッシュ）の取引日から作る
 selected_date_opt = None
 if game_mode in ['1m', '3m', '5m']:
     # イントラデイ用日付選択
     # 1分足・3分足は period="7d" が限界なので、直近7日分から選ぶ
     # 5分足は "60d"
-    check_period = "7d" if game_mode in ['1m', '3m'] else "60d"
-    check_interval = "1m" if game_mode in ['1m', '3m'] else "5m"
-    
-    with st.spinner("日付データを取得中..."):
-        # 日付リスト取得のためだけなので、リサンプリング不要で1m/5mそのまま使う
-        df_check, err = fetch_raw_data(ticker_input, check_period, check_interval)
-        
-        if df_check is not None and not df_check.empty:
-            dates = sorted(list(set(df_check.index.strftime('%Y-%m-%d'))), reverse=True)
+    with st.spinner("日付データを取得中..."), rate_limit.priority(rate_limit.META):
+        avail, err = get_availability(ticker_input, main_interval, base_interval, indicator_labels)
+
+        if avail and avail["dates"]:
             with c3:
-                selected_date_opt = st.selectbox("日付", dates)
+                selected_date_opt = st.selectbox("日付", avail["dates"][::-1])
         elif err:
             st.error(err)
 else:
     # 日足モードの場合
-    with st.spinner("データ確認中..."):
-        df_check, err = fetch_raw_data(ticker_input, "10y", "1d")
-        if df_check is not None and not df_check.empty and len(df_check) > 70:
-            min_date = df_check.index[50].date()
-            max_date = df_check.index[-PREDICT_DAYS_DAILY].date()
+    with st.spinner("データ確認中..."), rate_limit.priority(rate_limit.META):
+        avail, err = get_availability(ticker_input, main_interval, base_interval, indicator_labels)
+        if avail and len(avail["dates"]) > 70:
+            min_date = date.fromisoformat(avail["dates"][50])
+            max_date = date.fromisoformat(avail["dates"][-PREDICT_DAYS_DAILY])
             default_date = max_date
             
             with c3:
@@ -886,90 +377,59 @@ else:
 
 st.markdown("---")
 
-# 常に実行
-with st.spinner("データを準備中..."):
-    # メインチャート用データ
-    if game_mode == 'daily':
-        period = "10y"
-        interval = "1d"
-    elif game_mode in ['1m', '3m']:
-        period = "7d"
-        interval = game_mode # "1m" or "3m" (fetch_raw_data handles 3m)
-    else: # 5m
-        period = "60d"
-        interval = "5m"
-    
-    raw_df, error_msg = fetch_raw_data(ticker_input, period, interval)
-    
-    # サブチャート用データ（全候補取得）
-    sub_datasets = {}
-    sub_errors = []
-    
-    for label, sub_int in sub_mode_map.items():
-        # サブチャートの期間設定
-        # 日足/週足/月足は10yでOK
-        # 5分足は60d
-        s_period = "60d" if sub_int == "5m" else "10y"
-        
-        s_df, s_err = fetch_raw_data(ticker_input, s_period, sub_int)
-        if s_err:
-            sub_errors.append(f"{label}: {s_err}")
-            continue
-            
-        # MA計算
-        s_df['MA5'] = s_df['Close'].rolling(5).mean()
-        s_df['MA25'] = s_df['Close'].rolling(25).mean()
-        s_df['MA75'] = s_df['Close'].rolling(75).mean()
-        s_df = s_df.dropna()
-        sub_datasets[label] = s_df
-
-    if error_msg:
-        st.error(error_msg)
-    elif sub_errors:
-        st.error("サブチャート取得エラー: " + ", ".join(sub_errors))
+# ゲーム部分はフラグメントにする。ラウンド結果・「次へ」のイベントではここだけが再実行され、
+# 検索・先読み・日付選択はやり直さない
+@st.fragment
+def game_view(ticker, game_mode, main_interval, base_interval, sub_items, indicator_labels, selected_date):
+    own_trace = tracing.current() is None
+    if own_trace: tracing.start_trace("game")
+
+    game_id = "|".join([ticker, game_mode, str(selected_date), ",".join(indicator_labels)])
+    gs = game_state(game_id)
+    gs["meta"] = {"ticker": ticker, "mode": game_mode, "date": selected_date}
+    main_key = (ticker, main_interval, base_interval, indicator_labels)
+
+    with st.spinner("データを準備中..."):
+        # 今のラウンドの分だけ渡す（残りは「次へ」で要求されたときに送る）
+        game_data, has_next, err = main_payload(*main_key, game_mode, selected_date, gs["round"])
+        if not err:
+            with rate_limit.priority(rate_limit.SUB):
+                sub_map, sub_forming, err = sub_payloads(main_key, sub_items, game_mode, selected_date, gs["round"], gs["detail"])
+
+    if err:
+        st.error(err)
     else:
-        game_data, proc_err = process_data(raw_df, game_mode, selected_date_opt)
-        
-        if proc_err:
-            st.error(proc_err)
-        else:
-            # 各サブチャートを整形して格納
-            final_sub_map = {}
-            sub_intervals = {} # JSに渡す期間（秒）。日足などの場合は0
-            
-            # ゲーム終了時刻（ターゲットデータの最後）を取得して、そこまでサブチャートを含める
-            game_end_dt = None
-            if game_data['tgt']['c']:
-                last_tgt = game_data['tgt']['c'][-1]['time']
-                if game_mode == 'daily':
-                     game_end_dt = pd.Timestamp(last_tgt)
-                else:
-                    ts = last_tgt
-                    dt_utc = datetime.fromtimestamp(ts, timezone.utc)
-                    game_end_dt = dt_utc.replace(tzinfo=None)
-
-            for label, s_df in sub_datasets.items():
-                # Cutoff: allow up to game end
-                s_df_cut = s_df[s_df.index <= game_end_dt] if game_end_dt else s_df
-                
-                chart_d = {"c": [], "m5": [], "m25": [], "m75": []}
-                
-                is_sub_intraday = (label == "5分足")
-                sub_intervals[label] = 300 if is_sub_intraday else 0
-                
-                for t, r in s_df_cut.iterrows():
-                    if is_sub_intraday:
-                         # 5分足サブチャートの場合はタイムスタンプ（JST->UTC trick）
-                         t_val = int(t.replace(tzinfo=timezone.utc).timestamp())
-                    else:
-                         # 週足・月足・日足は日付文字列
-                         t_val = t.strftime('%Y-%m-%d')
-                         
-                    chart_d["c"].append({"time": t_val, "open": r['Open'], "high": r['High'], "low": r['Low'], "close": r['Close']})
-                    for m in ['m5', 'm25', 'm75']: chart_d[m].append({"time": t_val, "value": r['MA'+m[1:]]})
-                final_sub_map[label] = chart_d
-
-            comp_name = get_japanese_name(ticker_input)
-            # pass sub_intervals
-            game_html = render_game_html(game_data, final_sub_map, comp_name, ticker_input, game_mode, list(sub_mode_map.keys()), sub_intervals)
-            st.components.v1.html(game_html, height=850, scrolling=False)
+        comp_name = get_japanese_name(ticker)
+        with tracing.span("component"):
+            stock_game(game_data, sub_map, sub_forming, indicators.preset_lines(indicator_labels), comp_name,
+                       ticker, game_mode, [label for label, _, _ in sub_items], MESSAGES,
+                       game_id=game_id, round_no=gs["round"], has_next=has_next,
+                       key=GAME_KEY, on_change=on_game_event)
+        if has_next:
+            # 「次へ」ですぐ出せるよう、次のラウンドの切り出し・整形を裏で済ませておく
+            prefetch_later(main_payload, *main_key, game_mode, selected_date, gs["round"] + 1)
+            prefetch_later(sub_payloads, main_key, sub_items, game_mode, selected_date, gs["round"] + 1, gs["detail"])
+
+        if gs.get("error"):
+            st.warning(gs["error"])
+        if gs["results"]:
+            s = game_results.summarize(gs["results"])
+            st.caption(f"このゲームの成績: {s['rounds']}ラウンド {s['win']}勝 {s['lose']}敗（正解率 {s['rate']}%）")
+
+    if own_trace: tracing.finish_trace()
+
+if ticker_input:
+    # サブチャート: (ラベル, 足種, 取得元の足)
+    sub_items = tuple((label, sub_int, source_interval(sub_int)) for label, sub_int in sub_mode_map.items())
+    game_view(ticker_input, game_mode, main_interval, base_interval, sub_items, indicator_labels, selected_date_opt)
+
+# 計測結果（?debug=1 のときだけ表示）
+if DEBUG:
+    with st.expander("計測（このページの各段階）"):
+        st.dataframe(pd.DataFrame(tracing.trace_rows(page_trace)), hide_index=True)
+        used, budget = frame_cache.usage()
+        st.caption(f"データキャッシュ: {used / 1024 / 1024:.1f} / {budget / 1024 / 1024:.0f} MB")
+        st.dataframe(pd.DataFrame(frame_cache.report()), hide_index=True)
+        st.caption("上流への取得（順番待ち・見送り・アクセス制限）")
+        st.dataframe(pd.DataFrame(rate_limit.report()), hide_index=True)
+tracing.finish_trace()
@@ -0,0 +1,144 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+import company_master
+import game_engine
+import indicators
+from game_data import build_game_data
+from market_data import FETCH_PERIODS, load_bars, main_source, read_store
+from resample import resample_ohlcv
+
+# === 戦略のバックテスト（銘柄 × 全開始位置） ===
+# 銘柄ごとに別プロセスで処理し、銘柄の中は game_engine.score_actions で全ラウンドを一度に採点する。
+# 出力は戦略ごとの正解率の分布（0〜100% の度数）。ボットでも当たりすぎる局面＝簡単すぎる出題を見つけるのに使う
+# 例: python backtest.py 7203.T 6758.T -s follow -s ma_cross:5:25 -s momentum:3
+#     python backtest.py --master --offline     （マスタの全銘柄・保存済みデータのみ）
+WARMUP_BARS = 50  # ゲームと同じく、最低これだけ過去の足を見せてから出題する
+EASY_RATE = 80
+HARD_RATE = 20
+MODES = {"1d": "daily", "5m": "5m", "3m": "3m", "1m": "1m"}
+DEFAULT_STRATEGIES = [("follow",), ("gap",), ("momentum", 3), ("ma_cross", 5, 25)]
+
+
+def parse_strategy(text):
+    # "ma_cross:5:25" -> ("ma_cross", 5, 25)
+    name, *params = text.split(":")
+    if name not in game_engine.BOTS: raise argparse.ArgumentTypeError(f"不明な戦略: {name}")
+    return (name, *(float(p) if "." in p else int(p) for p in params))
+
+
+def strategy_label(spec):
+    return ":".join(str(p) for p in spec)
+
+
+def load_ticker(ticker, interval, offline=False):
+    # 戻り値: (df, err)。3分足などはゲームと同じく取得元の足から集約する（5分足は5分足の保存データ）
+    source = main_source(interval)
+    if offline:
+        df = read_store(ticker, source)
+        if df is None: return None, "保存データなし"
+    else:
+        df, err = load_bars(ticker, FETCH_PERIODS[source], source)
+        if err: return None, err
+    if source != interval: df = resample_ohlcv(df, interval)
+    return df, None
+
+
+def valid_starts(bars, offset, n_tgt, round_len, intraday):
+    # score_actions の各開始位置のうち採点するもの。20本そろうラウンドだけを数え、
+    # 分足はゲームと同じく1日の中で完結するものに限る
+    starts = np.arange(max(n_tgt - round_len, 0) + 1)
+    if n_tgt < round_len: return np.zeros(len(starts), dtype=bool)
+    if not intraday: return np.ones(len(starts), dtype=bool)
+    day = bars["t"][offset:].astype('datetime64[D]')
+    return day[starts] == day[starts + round_len - 1]
+
+
+def evaluate_ticker(ticker, interval="1d", strategies=DEFAULT_STRATEGIES, round_len=game_engine.ROUND_LEN, offline=False):
+    # 戻り値: (ticker, {spec: 正解率の度数（長さ101）}, err)
+    try:
+        df, err = load_ticker(ticker, interval, offline)
+        if err: return ticker, None, err
+
+        # 判断に使う指標だけ計算し、ゲームと同じ整数化済みデータ（build_game_data）にしてから採点する
+        specs = tuple(dict.fromkeys(s for spec in strategies for s in game_engine.bot_needs(spec)))
+        frame = df.join(indicators.compute(df, specs)).dropna()
+        if len(frame) < WARMUP_BARS + round_len: return ticker, None, "データ不足"
+        lines = [{"key": col, "color": "", "scale": "price"} for s in specs for col in indicators.columns(s)]
+        data = build_game_data(frame.iloc[:WARMUP_BARS], frame.iloc[WARMUP_BARS:], MODES[interval], lines)
+
+        bars, offset, up = game_engine.game_arrays(data)
+        mask = valid_starts(bars, offset, len(up), round_len, interval != "1d")
+        hists = {}
+        for spec in strategies:
+            acts = game_engine.bot_actions(spec, bars, offset)
+            rate = game_engine.score_actions(up, acts, round_len)["rate"][mask]
+            hists[spec] = np.bincount(rate, minlength=101)
+        return ticker, hists, None
+    except Exception as e:
+        return ticker, None, f"バックテストエラー: {e}"
+
+
+def summarize(hist):
+    # 度数分布から 件数・平均・分位点・簡単すぎる/難しすぎるラウンドの割合
+    n = int(hist.sum())
+    if n == 0: return {"rounds": 0}
+    rates = np.arange(len(hist))
+    cum = np.cumsum(hist)
+    pct = lambda q: int(np.searchsorted(cum, q * n))
+    return {
+        "rounds": n,
+        "mean": round(float((hist * rates).sum() / n), 1),
+        "p10": pct(0.1), "p50": pct(0.5), "p90": pct(0.9),
+        "easy": round(float(hist[EASY_RATE:].sum() / n), 3),
+        "hard": round(float(hist[:HARD_RATE + 1].sum() / n), 3),
+    }
+
+
+def run(tickers, interval="1d", strategies=DEFAULT_STRATEGIES, round_len=game_engine.ROUND_LEN, workers=None, offline=False):
+    # 戻り値: (戦略ごとの集計 DataFrame, 銘柄×戦略の集計 DataFrame, {ticker: err})
+    fn = partial(evaluate_ticker, interval=interval, strategies=strategies, round_len=round_len, offline=offline)
+    total = {spec: np.zeros(101, dtype=np.int64) for spec in strategies}
+    rows, errors = [], {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # 1銘柄は数ms〜で終わるので、まとめて渡してプロセス間のやりとりを減らす
+        chunksize = max(1, len(tickers) // ((workers or os.cpu_count() or 1) * 4))
+        for ticker, hists, err in pool.map(fn, tickers, chunksize=chunksize):
+            if err:
+                errors[ticker] = err
+                continue
+            for spec, h in hists.items():
+                total[spec] += h
+                rows.append({"ticker": ticker, "strategy": strategy_label(spec), **summarize(h)})
+    overall = pd.DataFrame([{"strategy": strategy_label(spec), **summarize(h)} for spec, h in total.items()])
+    return overall, pd.DataFrame(rows), errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ボットの正解率の分布を銘柄 × 全開始位置で集計する")
+    parser.add_argument("tickers", nargs="*", help="例: 7203.T")
+    parser.add_argument("--file", help="銘柄コードを1行1つ書いたファイル")
+    parser.add_argument("--master", action="store_true", help="銘柄マスタ（data/companies.csv）の全銘柄")
+    parser.add_argument("--interval", default="1d", choices=list(MODES))
+    parser.add_argument("-s", "--strategy", action="append", type=parse_strategy,
+                        help=f"名前[:パラメータ...]（{', '.join(game_engine.BOTS)}）。複数指定可")
+    parser.add_argument("--round-len", type=int, default=game_engine.ROUND_LEN)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--offline", action="store_true", help="保存済みデータだけを使う（ダウンロードしない）")
+    parser.add_argument("--out", help="銘柄ごとの集計を書き出す CSV")
+    args = parser.parse_args()
+
+    tickers = company_master.read_tickers(args.tickers, args.file, args.master)
+    if not tickers: parser.error("銘柄を指定してください")
+    overall, per_ticker, errors = run(tickers, args.interval, args.strategy or DEFAULT_STRATEGIES,
+                                      args.round_len, args.workers, args.offline)
+    print(overall.to_string(index=False))
+    if errors: print(f"\n失敗 {len(errors)} 件: " + ", ".join(f"{t}（{e}）" for t, e in list(errors.items())[:10]))
+    if args.out:
+        per_ticker.to_csv(args.out, index=False)
+        print(f"\n{len(per_ticker)} 行を書き出しました: {args.out}")
@@ -0,0 +1,287 @@
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import indicators
+import market_data
+from market_data import main_source, sub_source
+import rate_limit
+import shared_cache
+from game_data import PREDICT_DAYS_DAILY, slice_game_frames, round_window, build_game_data, build_sub_data
+from resample import resample_ohlcv
+from serialize import pack_payload
+
+# === ベンチマーク（ネットワークなし） ===
+# 記録済みの yfinance の取得結果（fixtures）を yf.download の代わりに返し、ページ表示までの各段階の
+# 時間（中央値）・ピークメモリ（tracemalloc）・ペイロードのバイト数を測る。baseline.json と比べて悪化を検出する
+#   python benchmark.py record 7203.T   … fixtures を実際の yfinance から記録（要ネットワーク）
+#   python benchmark.py synth           … 合成データの fixtures を作る（記録できない環境用）
+#   python benchmark.py run [--save] [--check]
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+FIXTURE_DIR = os.path.join(BENCH_DIR, "fixtures")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+DECODE_JS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "game_component", "frontend", "decode.js")
+
+# app.py のモード設定と同じ組み合わせ
+CASES = {
+    "daily_10y": {"mode": "daily", "interval": "1d", "subs": {"週足": "1wk", "月足": "1mo"}},
+    "5m_60d": {"mode": "5m", "interval": "5m", "subs": {"日足": "1d", "週足": "1wk"}},
+    "1m_7d": {"mode": "1m", "interval": "1m", "subs": {"5分足": "5m", "日足": "1d", "週足": "1wk"}},
+}
+FIXTURE_INTERVALS = ("1d", "5m", "1m")
+
+# baseline からこの倍率を超えたら悪化とみなす（時間・メモリは環境でぶれるので緩め）
+THRESHOLDS = {"ms": 1.3, "peak_kb": 1.2, "bytes": 1.02}
+
+
+def fixture_path(interval):
+    return os.path.join(FIXTURE_DIR, f"{interval}.parquet")
+
+
+def record(ticker):
+    import yfinance as yf
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    for interval in FIXTURE_INTERVALS:
+        df = yf.download(ticker, period=market_data.FETCH_PERIODS[interval], interval=interval, progress=False, auto_adjust=False)
+        if isinstance(df.columns, pd.MultiIndex): df.columns = df.columns.get_level_values(0)
+        df.to_parquet(fixture_path(interval))
+        print(f"{interval}: {len(df)} 本")
+
+
+def synth(seed=0):
+    # yfinance の戻り値と同じ形（Asia/Tokyo の tz 付き index, OHLCV + Adj Close）の合成データ
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp.now(tz='Asia/Tokyo').normalize()
+    days = pd.bdate_range(end=end.tz_localize(None), periods=2450)
+    sessions = {
+        "1d": days,
+        "5m": _intraday(days[-60:], "5min"),
+        "1m": _intraday(days[-7:], "1min"),
+    }
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    for interval, idx in sessions.items():
+        n = len(idx)
+        close = np.round(3000 * np.exp(np.cumsum(rng.normal(0, 0.01 if interval == "1d" else 0.001, n))), 1)
+        open_ = np.round(close * (1 + rng.normal(0, 0.003, n)), 1)
+        high = np.maximum(open_, close) + np.round(np.abs(rng.normal(0, 3, n)), 1)
+        low = np.minimum(open_, close) - np.round(np.abs(rng.normal(0, 3, n)), 1)
+        vol = rng.integers(1_000, 5_000_000, n)
+        df = pd.DataFrame({"Adj Close": close, "Close": close, "High": high, "Low": low, "Open": open_, "Volume": vol},
+                          index=idx.tz_localize('Asia/Tokyo'))
+        df.to_parquet(fixture_path(interval))
+        print(f"{interval}: {n} 本（合成）")
+
+
+def _intraday(days, freq):
+    # 前場 9:00-11:30 / 後場 12:30-15:30
+    parts = []
+    for d in days:
+        parts.append(pd.date_range(d + pd.Timedelta("9h"), d + pd.Timedelta("11h29m"), freq=freq))
+        parts.append(pd.date_range(d + pd.Timedelta("12h30m"), d + pd.Timedelta("15h29m"), freq=freq))
+    return parts[0].append(parts[1:])
+
+
+def load_fixtures():
+    out = {}
+    for interval in FIXTURE_INTERVALS:
+        df = pd.read_parquet(fixture_path(interval))
+        # 記録日からのずれを週単位で詰めて、最終足が直近になるようにする（曜日は変えない）
+        last = df.index[-1].tz_convert('Asia/Tokyo').tz_localize(None).normalize()
+        weeks = (pd.Timestamp.now().normalize() - last).days // 7
+        df.index = df.index + pd.Timedelta(weeks=weeks)
+        out[interval] = df
+    return out
+
+
+@contextlib.contextmanager
+def replay(fixtures, store_dir):
+    # yf.download を fixtures の再生に差し替え、保存先を一時ディレクトリにする
+    def download(ticker, period=None, start=None, interval="1d", **kwargs):
+        df = fixtures[interval]
+        if start is not None: df = df[df.index >= pd.Timestamp(start, tz=df.index.tz)]
+        return df.copy()
+
+    # 差分取得の速さを測るので、直前に取ったばかりでも毎回取りに行かせる（流量制限も外す）
+    import yfinance as yf
+    orig = (yf.download, market_data.STORE_DIR, market_data.FRESH_SECONDS, shared_cache.SHARED_DIR, rate_limit.RATES)
+    yf.download, market_data.STORE_DIR, market_data.FRESH_SECONDS = download, store_dir, 0
+    shared_cache.SHARED_DIR = os.path.join(store_dir, "shared")
+    rate_limit.RATES = {rate_limit.YF_HOST: (1e9, 1e9)}
+    rate_limit.reset()
+    try:
+        yield
+    finally:
+        yf.download, market_data.STORE_DIR, market_data.FRESH_SECONDS, shared_cache.SHARED_DIR, rate_limit.RATES = orig
+        rate_limit.reset()
+
+
+def measure(fn, repeat, setup=None):
+    # 戻り値: (fn の結果, {"ms": 中央値, "peak_kb": ピーク})
+    times = []
+    for _ in range(repeat):
+        if setup: setup()
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    if setup: setup()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, {"ms": round(statistics.median(times) * 1e3, 2), "peak_kb": round(peak / 1024)}
+
+
+def run_case(case, repeat, store_dir):
+    mode, interval, subs = case["mode"], case["interval"], case["subs"]
+    # 取得元はアプリと同じ（5m_60d は5分足の fixture を使う）
+    source = main_source(interval)
+    sources = {source} | {sub_source(s, source) for s in subs.values()}
+    stages = {}
+
+    def fetch():
+        return {src: market_data.load_bars("BENCH", market_data.FETCH_PERIODS[src], src)[0] for src in sources}
+
+    clear = lambda: shutil.rmtree(store_dir, ignore_errors=True)
+    raw, stages["fetch_cold"] = measure(fetch, repeat, setup=clear)
+    fetch()
+    raw, stages["fetch_warm"] = measure(fetch, repeat)
+
+    main = raw[source] if source == interval else resample_ohlcv(raw[source], interval)
+    labels = indicators.DEFAULT_PRESETS
+    lines = indicators.preset_lines(labels)
+    ind, stages["indicators"] = measure(lambda: indicators.compute(main, indicators.preset_specs(labels)), repeat)
+
+    date = main.index[-PREDICT_DAYS_DAILY].strftime('%Y-%m-%d') if mode == "daily" else main.index[-1].strftime('%Y-%m-%d')
+
+    def process():
+        ctx, tgt, err = slice_game_frames(main, mode, date, ind)
+        if err: raise RuntimeError(err)
+        ctx, tgt, _ = round_window(ctx, tgt, 0)
+        return ctx, tgt, build_game_data(ctx, tgt, mode, lines)
+    (ctx, tgt, data), stages["process"] = measure(process, repeat)
+
+    sub_labels = tuple(k for k in labels if indicators.PRESETS[k][2] == 'price')
+    sub_lines = indicators.preset_lines(sub_labels)
+
+    def sub_charts():
+        sub_map, forming = {}, {}
+        for label, sub_int in subs.items():
+            src = sub_source(sub_int, source)
+            s_df = raw[src] if sub_int == src else resample_ohlcv(raw[src], sub_int)
+            s_df = s_df.join(indicators.compute(s_df, indicators.preset_specs(sub_labels))).dropna()
+            sub_map[label], forming[label] = build_sub_data(s_df, main, ctx.index, tgt.index, sub_int, sub_lines)
+        return sub_map, forming
+    (sub_map, forming), stages["sub_charts"] = measure(sub_charts, repeat)
+
+    objs = {"data": data, "sub_map": sub_map, "sub_forming": forming}
+    packed, stages["payload"] = measure(lambda: {k: pack_payload(v) for k, v in objs.items()}, repeat)
+    stages["payload"]["bytes"] = sum(len(p) for p in packed.values())
+    stages["payload"]["raw_bytes"] = sum(len(pack_payload(v, compress=False)) for v in objs.values())
+
+    decode = client_decode(packed, repeat)
+    if decode: stages["client_decode"] = decode
+    return stages
+
+
+def client_decode(packed, repeat):
+    # フロントの展開・デコード（decode.js）を node で測る。node が無ければ省略
+    if shutil.which("node") is None: return None
+    script = """
+const fs = require('fs');
+eval(fs.readFileSync(process.argv[2], 'utf8') + '; global.D = {unpack, decodeChart, decodeForming};');
+const p = JSON.parse(fs.readFileSync(process.argv[3], 'utf8'));
+(async () => {
+  const times = [];
+  for (let r = 0; r < +process.argv[4]; r++) {
+    const t0 = performance.now();
+    const [d, s, f] = await Promise.all([p.data, p.sub_map, p.sub_forming].map(x => D.unpack(JSON.parse(x))));
+    D.decodeChart(d.ctx); D.decodeChart(d.tgt);
+    for (const k in s) D.decodeChart(s[k]);
+    for (const k in f) D.decodeForming(f[k]);
+    times.push(performance.now() - t0);
+  }
+  times.sort((a, b) => a - b);
+  console.log(JSON.stringify({ ms: +times[times.length >> 1].toFixed(2) }));
+})();
+"""
+    with tempfile.TemporaryDirectory() as tmp:
+        js, payload = os.path.join(tmp, "decode_bench.js"), os.path.join(tmp, "payload.json")
+        with open(js, 'w') as f: f.write(script)
+        with open(payload, 'w') as f: json.dump(packed, f)
+        res = subprocess.run(["node", js, DECODE_JS, payload, str(repeat)], capture_output=True, text=True)
+    if res.returncode != 0: return None
+    return json.loads(res.stdout)
+
+
+def run(repeat=5, cases=None):
+    fixtures = load_fixtures()
+    results = {}
+    with tempfile.TemporaryDirectory() as store_dir, replay(fixtures, store_dir):
+        for name in cases or CASES:
+            results[name] = run_case(CASES[name], repeat, store_dir)
+    return results
+
+
+def compare(results, baseline):
+    # 戻り値: 悪化した項目の一覧 [(case, stage, metric, baseline, now)]
+    worse = []
+    for case, stages in results.items():
+        for stage, metrics in stages.items():
+            base = baseline.get(case, {}).get(stage, {})
+            for metric, limit in THRESHOLDS.items():
+                if metric in metrics and base.get(metric) and metrics[metric] > base[metric] * limit:
+                    worse.append((case, stage, metric, base[metric], metrics[metric]))
+    return worse
+
+
+def format_table(results):
+    rows = [{"case": case, "stage": stage, **metrics} for case, stages in results.items() for stage, metrics in stages.items()]
+    return pd.DataFrame(rows, dtype=object).fillna("").to_string(index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="記録済みデータで取得〜ペイロード生成の各段階を計測する")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_rec = sub.add_parser("record", help="yfinance から fixtures を記録する（要ネットワーク）")
+    p_rec.add_argument("ticker", nargs="?", default="7203.T")
+    p_syn = sub.add_parser("synth", help="合成データの fixtures を作る")
+    p_syn.add_argument("--seed", type=int, default=0)
+    p_run = sub.add_parser("run", help="計測する")
+    p_run.add_argument("--repeat", type=int, default=5)
+    p_run.add_argument("--case", action="append", choices=list(CASES))
+    p_run.add_argument("--save", action="store_true", help=f"結果を baseline として保存（{BASELINE_PATH}）")
+    p_run.add_argument("--check", action="store_true", help="baseline より悪化していたら終了コード 1")
+    args = parser.parse_args()
+
+    if args.cmd == "record":
+        record(args.ticker)
+    elif args.cmd == "synth":
+        synth(args.seed)
+    else:
+        if not all(os.path.exists(fixture_path(i)) for i in FIXTURE_INTERVALS):
+            raise SystemExit(f"fixtures がありません: {FIXTURE_DIR}（record か synth で作成してください）")
+        results = run(args.repeat, args.case)
+        print(format_table(results))
+        worse = []
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH, encoding='utf-8') as f:
+                worse = compare(results, json.load(f))
+            for case, stage, metric, before, now in worse:
+                print(f"悪化: {case} / {stage} / {metric}: {before} -> {now}")
+        if args.save:
+            with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=1)
+            print(f"baseline を保存しました: {BASELINE_PATH}")
+        if args.check and worse: raise SystemExit(1)
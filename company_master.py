@@ -0,0 +1,135 @@
+import argparse
+import bisect
+import csv
+import os
+import unicodedata
+from collections import defaultdict
+
+# === 上場銘柄マスタ（オフライン検索用） ===
+# data/companies.csv（列: code, name, kana, name_en）を起動時に1回読み込み、
+# 前方一致（ソート済みキー + 二分探索）と部分一致（1/2-gram の転置索引）で引く。
+# 作成: python company_master.py  （JPX の上場銘柄一覧 data_j.xls から生成。kana / name_en は空欄で、
+# 別途埋めた列があればそのまま使う）
+MASTER_PATH = os.environ.get(
+    "STOCK_COMPANY_MASTER",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "companies.csv"),
+)
+JPX_LIST_URL = "https://www.jpx.co.jp/markets/statistics-equities/misc/tvdivq0000001vg2-att/data_j.xls"
+
+FIELDS = ["code", "name", "kana", "name_en"]
+# 検索時に無視する表記
+NOISE = ["株式会社", "(株)", " ", "・", "　"]
+
+
+def normalize(text):
+    # 全角英数→半角、半角カナ→全角（NFKC）、ひらがな→カタカナ、小文字化
+    text = unicodedata.normalize('NFKC', text or "").lower()
+    text = "".join(chr(ord(ch) + 0x60) if 'ぁ' <= ch <= 'ゖ' else ch for ch in text)
+    for w in NOISE:
+        text = text.replace(w, "")
+    return text
+
+
+def _grams(key):
+    if len(key) < 2: return set(key)
+    return {key[i:i + 2] for i in range(len(key) - 1)}
+
+
+class CompanyMaster:
+    def __init__(self, rows):
+        self.codes = [r["code"] for r in rows]
+        self.names = [r["name"] for r in rows]
+        self.by_code = {c: i for i, c in enumerate(self.codes)}
+        self.keys = []
+        prefix = []
+        self.grams = defaultdict(set)
+        for i, r in enumerate(rows):
+            keys = {normalize(r.get(f)) for f in FIELDS} - {""}
+            self.keys.append(keys)
+            for k in keys:
+                prefix.append((k, i))
+                for g in _grams(k) | set(k):
+                    self.grams[g].add(i)
+        prefix.sort()
+        self.prefix_keys = [k for k, _ in prefix]
+        self.prefix_ids = [i for _, i in prefix]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def search(self, query, limit=20):
+        # 戻り値: [(コード, 銘柄名)]。コード完全一致 → 前方一致 → 部分一致 の順
+        q = normalize(query)
+        if not q: return []
+        hits = []
+        seen = set()
+
+        def add(i):
+            if i not in seen:
+                seen.add(i)
+                hits.append(i)
+
+        if q.upper() in self.by_code: add(self.by_code[q.upper()])
+
+        # 前方一致はキーの辞書順に limit 件まで
+        pos = bisect.bisect_left(self.prefix_keys, q)
+        while len(hits) < limit and pos < len(self.prefix_keys) and self.prefix_keys[pos].startswith(q):
+            add(self.prefix_ids[pos])
+            pos += 1
+
+        if len(hits) < limit:
+            sets = [self.grams.get(g, set()) for g in _grams(q)]
+            cand = set.intersection(*sets) if sets else set()
+            for i in sorted(cand - seen, key=lambda i: self.codes[i]):
+                if any(q in k for k in self.keys[i]): add(i)
+
+        return [(self.codes[i], self.names[i]) for i in hits[:limit]]
+
+    def name(self, code):
+        i = self.by_code.get(code.upper())
+        return None if i is None else self.names[i]
+
+
+def load(path=MASTER_PATH):
+    if not os.path.exists(path): return None
+    with open(path, encoding='utf-8', newline='') as f:
+        rows = [r for r in csv.DictReader(f) if r.get("code")]
+    return CompanyMaster(rows) if rows else None
+
+
+def read_tickers(tickers=(), path=None, master=False):
+    # コマンドライン用: 引数・ファイル（1行1銘柄、# はコメント）・マスタの全銘柄を重複なしでまとめる
+    tickers = list(tickers)
+    if path:
+        with open(path, encoding='utf-8') as f:
+            tickers += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    if master:
+        m = load()
+        if m is None: raise SystemExit(f"銘柄マスタがありません: {MASTER_PATH}")
+        tickers += [f"{code}.T" for code in m.codes]
+    return list(dict.fromkeys(tickers))
+
+
+def build(src=JPX_LIST_URL, out=MASTER_PATH):
+    import pandas as pd
+    if str(src).endswith('.csv'):
+        df = pd.read_csv(src, dtype=str)
+    else:
+        # JPX の xls を読むには xlrd が必要
+        df = pd.read_excel(src, dtype=str)
+    df = df.rename(columns={"コード": "code", "銘柄名": "name"})
+    for c in FIELDS:
+        if c not in df.columns: df[c] = ""
+    df = df[FIELDS].fillna("")
+    df["code"] = df["code"].str.strip()
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    df.to_csv(out, index=False, encoding='utf-8')
+    return len(df)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="上場銘柄マスタ (data/companies.csv) を作成する")
+    parser.add_argument("src", nargs="?", default=JPX_LIST_URL, help="JPX の data_j.xls（パス or URL）、または code,name[,kana,name_en] の CSV")
+    parser.add_argument("--out", default=MASTER_PATH)
+    args = parser.parse_args()
+    print(f"{build(args.src, args.out)} 件を書き出しました: {args.out}")
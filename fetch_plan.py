@@ -0,0 +1,75 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import rate_limit
+import tracing
+
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:
+    add_script_run_ctx = get_script_run_ctx = None
+
+# === 先読み（ページ表示に必要な取得をまとめて並列実行する） ===
+# 同じ (関数, 引数) は1回だけ実行する。結果は各関数のキャッシュ（st.cache_data など）に載るので、
+# 後続の通常の呼び出しはキャッシュヒットになる。冷えた状態の待ち時間は「一番遅い1件」で済む
+# 上流への取得は rate_limit の優先度順に並ぶ（add の priority。同じ呼び出しが複数あれば高い方）
+
+
+class FetchPlan:
+    def __init__(self):
+        self.calls = {}
+        self.priorities = {}
+
+    def add(self, fn, *args, priority=rate_limit.MAIN):
+        key = (fn, args)
+        self.calls.setdefault(key, None)
+        self.priorities[key] = min(priority, self.priorities.get(key, priority))
+        return self
+
+    def run(self, max_workers=8):
+        if not self.calls: return {}
+        ctx = get_script_run_ctx() if get_script_run_ctx else None
+
+        def init():
+            # Streamlit のスクリプト文脈を引き継ぐ（キャッシュ関数を別スレッドから呼ぶため）
+            if ctx is not None: add_script_run_ctx(threading.current_thread(), ctx)
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(self.calls)), initializer=init) as pool:
+            # 計測のスパンも呼び出し元のページに紐付ける
+            futures = {key: pool.submit(tracing.bind(rate_limit.prioritized(self.priorities[key], key[0])), *key[1])
+                       for key in self.calls}
+        for key, fut in futures.items():
+            try:
+                self.calls[key] = fut.result()
+            except Exception as e:
+                self.calls[key] = e
+        return self.calls
+
+    def result(self, fn, *args):
+        return self.calls.get((fn, args))
+
+
+# === 裏での先読み（次のラウンドなど、まだ要求されていないものを空き時間に用意しておく） ===
+# ページの表示は待たない。結果は各関数のキャッシュに載るだけで、失敗しても何もしない。
+# 上流への取得が要るときは一番低い優先度（BACKGROUND）で並ぶ
+_background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def prefetch_later(fn, *args):
+    key = (getattr(fn, "__qualname__", fn), args)
+    with _pending_lock:
+        if key in _pending: return
+        _pending.add(key)
+
+    def job():
+        try:
+            with rate_limit.priority(rate_limit.BACKGROUND):
+                fn(*args)
+        except Exception:
+            pass
+        finally:
+            with _pending_lock:
+                _pending.discard(key)
+    _background.submit(job)
@@ -0,0 +1,206 @@
+import contextvars
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+# === 足データ・指標のキャッシュ（メモリ上限付き LRU） ===
+# st.cache_data は件数・メモリの上限がなく、ヒットのたびに pickle から復元する（セッションごとにコピーが増える）。
+# ここでは1つの表をプロセス内で共有し、呼び出し側には
+# - DataFrame / Series: 浅いコピー（Copy-on-Write なので列の追加や値の書き換えはキャッシュに波及しない）
+# - ndarray: 書き込み禁止にしたもの
+# を返す。エントリごとのバイト数を数え、合計が予算を超えたら最後に使われたのが古いものから捨てる
+MAX_BYTES = int(float(os.environ.get("STOCK_CACHE_MB", "512")) * 1024 * 1024)
+DEFAULT_TTL = 3600
+
+# 作っている途中の値ごとの「短く覚える」印（short_lived() で立て、外側の cached にも伝える）
+_short = contextvars.ContextVar("frame_cache_short", default=None)
+# refreshing() の中か（キャッシュを引かずに作り直す）
+_refresh = contextvars.ContextVar("frame_cache_refresh", default=False)
+
+# pandas 2 系は Copy-on-Write が既定で無効（3 系からは常に有効）
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+
+def nbytes(value):
+    # 値が抱えているおおよそのバイト数（DataFrame はインデックスと object 列の中身まで数える）
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, list) and value and isinstance(value[0], (int, float)):
+        # 整形済みの数値列は要素ごとに数えない（int 1つ ≒ 本体 28 + 参照 8 バイト）
+        return 36 * len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 64
+
+
+def freeze(value):
+    # 保存する側: ndarray は書き込み禁止に（DataFrame は share で毎回浅いコピーを渡す）
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, tuple):
+        for v in value: freeze(v)
+    elif isinstance(value, dict):
+        for v in value.values(): freeze(v)
+    return value
+
+
+def share(value):
+    # 渡す側: データ本体はコピーせず、呼び出し側が容器を書き換えてもキャッシュが変わらないようにする
+    # （list は整形済みの数値列を想定して浅いコピーだけ。中の要素まではたどらない）
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=False)
+    if isinstance(value, tuple):
+        return tuple(share(v) for v in value)
+    if isinstance(value, list):
+        return value.copy()
+    if isinstance(value, dict):
+        return {k: share(v) for k, v in value.items()}
+    return value
+
+
+class FrameCache:
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.data = OrderedDict()  # key -> (期限, バイト数, 値, 短く覚えたか)
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {}  # 関数名 -> {"hit", "miss", "evict"}
+
+    def _count(self, name, what):
+        s = self.stats.setdefault(name, {"hit": 0, "miss": 0, "evict": 0})
+        s[what] += 1
+
+    def get(self, key):
+        # 戻り値: (ヒットしたか, 値, 短く覚えた値か)
+        with self.lock:
+            hit = self.data.get(key)
+            if hit is not None and hit[0] <= time.monotonic():
+                self._drop(key)
+                hit = None
+            if hit is None:
+                self._count(key[0], "miss")
+                return False, None, False
+            self.data.move_to_end(key)
+            self._count(key[0], "hit")
+            return True, share(hit[2]), hit[3]
+
+    def put(self, key, value, ttl=DEFAULT_TTL, short=False):
+        size = nbytes(value)
+        freeze(value)
+        with self.lock:
+            if key in self.data: self._drop(key)
+            # 1件で予算を超えるものは保存しない（他を全部追い出してしまうため）
+            if size > self.max_bytes: return share(value)
+            self.data[key] = (time.monotonic() + ttl, size, value, short)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                old = next(iter(self.data))
+                self._drop(old)
+                self._count(old[0], "evict")
+        return share(value)
+
+    def _drop(self, key):
+        size = self.data.pop(key)[1]
+        self.bytes -= size
+
+    def clear(self, name=None):
+        with self.lock:
+            for key in [k for k in self.data if name is None or k[0] == name]:
+                self._drop(key)
+
+    def report(self):
+        # 関数ごとの件数・バイト数・ヒット率
+        with self.lock:
+            usage = {}
+            for key, entry in self.data.items():
+                u = usage.setdefault(key[0], [0, 0])
+                u[0] += 1
+                u[1] += entry[1]
+            rows = []
+            for name in sorted(set(usage) | set(self.stats)):
+                s = self.stats.get(name, {"hit": 0, "miss": 0, "evict": 0})
+                calls = s["hit"] + s["miss"]
+                n, size = usage.get(name, (0, 0))
+                rows.append({"name": name, "entries": n, "mb": round(size / 1024 / 1024, 2),
+                             "hit": s["hit"], "miss": s["miss"], "evict": s["evict"],
+                             "hit_rate": round(s["hit"] / calls, 3) if calls else None})
+            return rows
+
+
+_cache = FrameCache()
+
+
+def short_lived():
+    # 今作っている値を（エラーでなくても）fail_ttl で覚えさせる。古い保存データで代用したときなど。
+    # その値を使って作る外側の cached の値も同じく短くなる（キャッシュヒットで使った場合も）
+    flag = _short.get()
+    if flag is not None: flag[0] = True
+
+
+@contextmanager
+def refreshing():
+    # この中で呼んだ cached は（内側で呼ぶものも）キャッシュを引かずに作り直し、エントリを置き換える。
+    # 先温めで期限前の表を新しい足に入れ替えるため
+    token = _refresh.set(True)
+    try:
+        yield
+    finally:
+        _refresh.reset(token)
+
+
+def cached(ttl=DEFAULT_TTL, cache=None, fail_ttl=None):
+    # st.cache_data の代わりに使うデコレータ。引数はハッシュ可能なもの（文字列・数値・タプル）に限る
+    # fail_ttl: 戻り値が (..., err) で err があるとき・short_lived() されたときの TTL
+    # （混雑で見送った取得などを長く覚えない）
+    def deco(fn):
+        name = fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args):
+            c = cache or _cache
+            key = (name, args)
+            hit, value, short = (False, None, False) if _refresh.get() else c.get(key)
+            if hit:
+                if short: short_lived()
+                return value
+            flag = [False]
+            token = _short.set(flag)
+            try:
+                value = fn(*args)
+            finally:
+                _short.reset(token)
+            short = flag[0] and fail_ttl is not None
+            if short: short_lived()
+            failed = fail_ttl is not None and isinstance(value, tuple) and value[-1] is not None
+            return c.put(key, value, fail_ttl if failed or short else ttl, short)
+        wrapper.clear = lambda: (cache or _cache).clear(name)
+        return wrapper
+    return deco
+
+
+def report():
+    return _cache.report()
+
+
+def usage():
+    # 戻り値: (使用バイト数, 予算バイト数)
+    return _cache.bytes, _cache.max_bytes
+
+
+def clear():
+    _cache.clear()
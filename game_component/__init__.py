@@ -0,0 +1,59 @@
+import hashlib
+import os
+
+import streamlit.components.v1 as components
+
+import tracing
+from serialize import pack_payload
+
+# === ゲーム画面（Streamlit カスタムコンポーネント） ===
+# HTML/JS/CSS と Lightweight Charts は frontend/ に置いて Streamlit から配信する（外部CDN・Webフォントは使わない）。
+# key を固定しているので iframe は再実行をまたいで使い回され、届くのはデータの引数だけ。
+# JS 側は payload_id が変わったときだけ描画し直す
+#
+# 戻り値（フロント → Python）はイベントの dict。値が変わるたびに on_change が呼ばれて再実行される
+#   {"type": "round", "game", "round", "attempt", "win", "lose", "decisions": [{"t", "act", "up", "win"}], "seq", "at"}
+#   {"type": "next", "game", "round", "seq", "at"}   … 次のラウンドの要求
+#   {"type": "detail", "game", "round", "chart", "seq", "at"}   … サブチャート chart の古い履歴を全部ほしい
+#     （まとめて送った部分までスクロールされたとき。同じラウンドのままサブチャートだけ差し替わる）
+# 1ターンごとに再実行させないよう、各ターンの判断はラウンド結果にまとめて送る
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend")
+INTRADAY_MODES = ("5m", "3m", "1m")
+
+_component = components.declare_component("stock_game", path=FRONTEND_DIR)
+
+
+def stock_game(data, sub_data_map, sub_forming, lines, ticker_name, ticker_code, mode, sub_mode_keys, messages,
+               game_id="", round_no=0, has_next=False, key="stock_game", on_change=None):
+    # 列形式・差分・整数化した上で、大きければ圧縮して渡す（展開は frontend/decode.js）
+    # pack_payload 済みの文字列はそのまま渡す（呼び出し側でキャッシュしておける）
+    with tracing.span("payload"):
+        payload = {
+            "data": data,
+            "sub_map": sub_data_map,
+            "sub_forming": sub_forming,
+        }
+        payload = {k: v if isinstance(v, str) else pack_payload(v) for k, v in payload.items()}
+        h = hashlib.sha1()
+        for k in ("data", "sub_map", "sub_forming"):
+            h.update(payload[k].encode('utf-8'))
+        h.update(repr((game_id, round_no, lines, ticker_name, ticker_code, mode, sub_mode_keys)).encode('utf-8'))
+        tracing.note(bytes=sum(len(v) for v in payload.values()))
+
+    return _component(
+        **payload,
+        payload_id=h.hexdigest(),
+        lines=lines,
+        messages=messages,
+        ticker_name=ticker_name,
+        ticker_code=ticker_code,
+        mode=mode,
+        intraday=mode in INTRADAY_MODES,
+        sub_keys=list(sub_mode_keys),
+        game=game_id,
+        round=round_no,
+        has_next=has_next,
+        key=key,
+        default=None,
+        on_change=on_change,
+    )
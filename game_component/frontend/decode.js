@@ -0,0 +1,37 @@
+// === serialize.py の送信形式のデコーダ ===
+// 時刻・価格・指標は差分で届くので累積和で戻す。大きいペイロードは {z: base64(deflate)}
+async function unpack(p) {
+    if (!p || p.z === undefined) return p;
+    const bin = Uint8Array.from(atob(p.z), ch => ch.charCodeAt(0));
+    const stream = new Blob([bin]).stream().pipeThrough(new DecompressionStream('deflate'));
+    return await new Response(stream).json();
+}
+function undelta(a) {
+    const out = new Array(a.length);
+    let acc = 0;
+    for (let i = 0; i < a.length; i++) { acc += a[i]; out[i] = acc; }
+    return out;
+}
+function decodeTimes(p) {
+    return undelta(p.t).map(x => p.tu === 1 ? x : new Date(x * p.tu * 1000).toISOString().slice(0, 10));
+}
+function decodeCandles(p, t) {
+    const ps = Math.pow(10, p.pd);
+    const o = undelta(p.o), h = undelta(p.h), l = undelta(p.l), c = undelta(p.c);
+    const out = new Array(t.length);
+    for (let i = 0; i < t.length; i++) out[i] = { time: t[i], open: o[i] / ps, high: h[i] / ps, low: l[i] / ps, close: c[i] / ps };
+    return out;
+}
+function decodeChart(p) {
+    const t = decodeTimes(p);
+    const out = { c: decodeCandles(p, t), ind: {} };
+    if (p.v) out.v = p.v.map((v, i) => ({ time: t[i], value: v }));
+    for (const k in p.ind) {
+        const s = Math.pow(10, p.ld[k]);
+        out.ind[k] = undelta(p.ind[k]).map((v, i) => ({ time: t[i], value: v / s }));
+    }
+    return out;
+}
+function decodeForming(p) {
+    return { s0: p.s0, n: undelta(p.n), f: decodeCandles(p, decodeTimes(p)) };
+}
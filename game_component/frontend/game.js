@@ -0,0 +1,428 @@
+// === 株価当てゲーム（フロント側） ===
+// チャートは最初の1回だけ作り、再実行で届いたデータは同じ iframe の中で差し替える。
+// 引数が前回と同じ（payload_id が同じ）なら何もしない＝ゲームの途中状態は保たれる。
+// 届くのは今のラウンドの足だけ。結果と「次へ」は setComponentValue で Python に返す
+(function(){
+    const UP = '#10b981', DOWN = '#f43f5e', NEXT = '#FFD700';
+
+    let d = null;            // { ctx, tgt }
+    let subDMap = {};
+    let subForming = {};     // メインの各ステップに対するサブチャートの確定足本数・形成中の足（Python側で前計算）
+    let MSGS = {};
+    let payloadId = null;
+    let dataArg = null;      // 前回のメインの引数（サブチャートだけの差し替えかどうかの判定用）
+    let loadSeq = 0;
+    let detailAsked = {};    // 古い履歴を全部要求済みのサブチャート
+
+    let game = null;         // Python 側のゲームID（イベントに付けて返す）
+    let roundNo = 0;
+    let hasNext = false;
+    let attempt = 0;         // 同じラウンドの挑戦回数（もう一度で増える）
+    let decisions = [];      // このラウンドの各ターンの判断
+    let evSeq = 0;
+
+    let idx = 0;
+    let w = 0, l = 0;
+    let ac = null; let priceLine = null;
+    let currentSubKey = null;
+
+    const $ = (id) => document.getElementById(id);
+
+    // === Main Chart ===
+    const chartBase = {
+        layout: { background: { type: 'solid', color: '#222' }, textColor: '#9ca3af', fontFamily: getComputedStyle(document.body).fontFamily },
+        grid: { vertLines: { visible: false }, horzLines: { visible: true, color: '#333' } }
+    };
+    const chart = LightweightCharts.createChart($('chart-area'), Object.assign({}, chartBase, {
+        timeScale: { timeVisible: true, secondsVisible: false },
+        rightPriceScale: { borderColor: '#333', scaleMargins: { top: 0.1, bottom: 0.2 } },
+        crosshair: { vertLine: { color: '#555', labelBackgroundColor: '#555' }, horzLine: { color: '#555', labelBackgroundColor: '#555' } }
+    }));
+
+    // === Sub Chart ===
+    const subChart = LightweightCharts.createChart($('sub-chart-area'), Object.assign({}, chartBase, {
+        rightPriceScale: { borderColor: '#333' },
+        timeScale: { borderVisible: false }
+    }));
+
+    // 分足は時刻（JSTをUTCとして送っているので UTC のまま表示）
+    const intradayTimeScale = {
+        timeVisible: true,
+        secondsVisible: false,
+        tickMarkFormatter: (time) => {
+            const t = new Date(time * 1000);
+            return t.getUTCHours().toString().padStart(2, '0') + ':' + t.getUTCMinutes().toString().padStart(2, '0');
+        }
+    };
+
+    // 指標の線（Python側で選択されたもの）。price: ローソク足と同じスケール / volume: 出来高 / osc: 下部の別スケール
+    const SCALE_IDS = { price: 'right', volume: '', osc: 'osc' };
+    const BOTTOM_MARGINS = { scaleMargins: { top: 0.8, bottom: 0 } };
+    function addLine(target, ln) {
+        const s = target.addLineSeries({ color: ln.color, lineWidth: 1, crosshairMarkerVisible: false, lastValueVisible: false, priceLineVisible: false, priceScaleId: SCALE_IDS[ln.scale] });
+        if (ln.scale !== 'price') s.priceScale().applyOptions(BOTTOM_MARGINS);
+        return { key: ln.key, s: s };
+    }
+    const candleOpts = (up, down) => ({ upColor: up, downColor: down, borderUpColor: up, borderDownColor: down, wickUpColor: up, wickDownColor: down });
+
+    let sLines = [], ssLines = [], sC = null, sNextOpen = null, sV = null, ssC = null;
+
+    // 系列は描画順＝追加順なので、線の構成が変わったら全部作り直す（線がローソク足の下になるように）
+    function buildSeries(lines) {
+        for (const s of [...sLines.map(x => x.s), sC, sNextOpen, sV]) if (s) chart.removeSeries(s);
+        for (const s of [...ssLines.map(x => x.s), ssC]) if (s) subChart.removeSeries(s);
+        priceLine = null;
+
+        sLines = lines.map(ln => addLine(chart, ln));
+        sC = chart.addCandlestickSeries(Object.assign(candleOpts(UP, DOWN), { lastValueVisible: false, priceLineVisible: false }));
+        sNextOpen = chart.addCandlestickSeries(Object.assign(candleOpts(NEXT, NEXT), { lastValueVisible: false, priceLineVisible: false }));
+        sV = chart.addHistogramSeries({
+            priceFormat: { type: 'volume' }, priceScaleId: '',
+            color: 'rgba(200, 200, 200, 0.4)',
+            lastValueVisible: false, priceLineVisible: false
+        });
+        sV.priceScale().applyOptions(BOTTOM_MARGINS);
+
+        // サブチャートには価格スケールの線だけ出す
+        ssLines = lines.filter(ln => ln.scale === 'price').map(ln => addLine(subChart, ln));
+        ssC = subChart.addCandlestickSeries(candleOpts(UP, DOWN));
+    }
+
+    // 表示中の本数を覚えておき、ターンごとの更新は追加分だけ series.update する
+    // （全件 setData はラウンド開始とサブチャートの足切り替え時のみ）
+    let mainShown = -1;               // メインに表示中の tgt 本数
+    let subShown = 0;                 // サブに表示中の確定足の本数
+    let subForm = null;               // サブに表示中の形成中の足
+
+    // 現在のステップ（tgt を idx 本表示）でサブに出す確定足の本数と形成中の足
+    // 表が無いときも全件は出さない（出題の日の足が見えてしまう）
+    function subTarget(sd, tb, step) {
+        if (!tb || tb.n.length === 0) return { n: 0, form: null };
+        const k = Math.min(step, tb.n.length - 1);
+        const f = k - tb.s0;
+        return { n: Math.min(tb.n[k], sd.c.length), form: f >= 0 ? tb.f[f] : null };
+    }
+
+    function syncSubChart(full) {
+        const sd = subDMap[currentSubKey];
+        if (!sd) return;
+        const tgt = subTarget(sd, subForming[currentSubKey], idx);
+
+        // 巻き戻し（もう一度）や、前の形成中の足が確定足で置き換わらない場合は作り直す
+        if (!full && tgt.n < subShown) full = true;
+        if (!full && subForm) {
+            const lastDone = tgt.n > 0 ? sd.c[tgt.n - 1].time : null;
+            const replaced = (lastDone !== null && lastDone >= subForm.time) || (tgt.form && tgt.form.time === subForm.time);
+            if (!replaced) full = true;
+        }
+
+        if (full) {
+            const cData = sd.c.slice(0, tgt.n);
+            if (tgt.form) cData.push(tgt.form);
+            ssC.setData(cData);
+            for (const ln of ssLines) ln.s.setData(sd.ind[ln.key].slice(0, tgt.n));
+            if (cData.length > 0) {
+                const fromIdx = Math.max(0, cData.length - 100);
+                subChart.timeScale().setVisibleLogicalRange({ from: fromIdx, to: cData.length + 4 });
+            } else {
+                subChart.timeScale().fitContent();
+            }
+        } else {
+            for (let k = subShown; k < tgt.n; k++) {
+                ssC.update(sd.c[k]);
+                for (const ln of ssLines) ln.s.update(sd.ind[ln.key][k]);
+            }
+            if (tgt.form) ssC.update(tgt.form);
+        }
+        subShown = tgt.n;
+        subForm = tgt.form;
+    }
+
+    // 古い履歴はまとめて届く（先頭 dz 本）。そこまでスクロールされたら全部を要求する
+    subChart.timeScale().subscribeVisibleLogicalRangeChange((r) => {
+        const sd = subDMap[currentSubKey];
+        if (!r || !sd || !sd.dz || r.from >= sd.dz || detailAsked[currentSubKey]) return;
+        detailAsked[currentSubKey] = true;
+        report('detail', { chart: currentSubKey });
+    });
+
+    // 下部チャート切り替え event
+    $('sub-chart-select').onchange = (e) => {
+        currentSubKey = e.target.value;
+        syncSubChart(true);
+    };
+
+    // Main Chart Functions
+    function updateNextOpenDisplay() {
+        if (idx >= d.tgt.c.length) {
+            sNextOpen.setData([]);
+            $('price-label').style.display = 'none';
+            if (priceLine) { sC.removePriceLine(priceLine); priceLine = null; }
+            return;
+        }
+        const nextData = d.tgt.c[idx];
+        $('price-val').innerText = nextData.open.toLocaleString();
+        $('price-label').style.display = 'block';
+        if (priceLine) sC.removePriceLine(priceLine);
+        priceLine = sC.createPriceLine({ price: nextData.open, color: NEXT, lineWidth: 1, lineStyle: 2, axisLabelVisible: false });
+        sNextOpen.setData([{ time: nextData.time, open: nextData.open, high: nextData.open, low: nextData.open, close: nextData.open }]);
+    }
+
+    function render(i, full) {
+        if (full || i < mainShown) {
+            sC.setData([...d.ctx.c, ...d.tgt.c.slice(0, i)]);
+            sV.setData([...d.ctx.v, ...d.tgt.v.slice(0, i)]);
+            for (const ln of sLines) ln.s.setData([...d.ctx.ind[ln.key], ...d.tgt.ind[ln.key].slice(0, i)]);
+        } else {
+            for (let k = mainShown; k < i; k++) {
+                sC.update(d.tgt.c[k]);
+                sV.update(d.tgt.v[k]);
+                for (const ln of sLines) ln.s.update(d.tgt.ind[ln.key][k]);
+            }
+        }
+        mainShown = i;
+        updateNextOpenDisplay();
+
+        // Update Sub Chart
+        if (currentSubKey) syncSubChart(full);
+    }
+
+    // Python へイベントを返す（値が変わるたびに再実行されるので、ターン単位では送らない）
+    function report(type, extra) {
+        Streamlit.setComponentValue(Object.assign({ type: type, game: game, round: roundNo, seq: ++evSeq, at: Date.now() }, extra));
+    }
+
+    function initGame() {
+        idx = 0;
+        w = 0; l = 0;
+        attempt++;
+        decisions = [];
+
+        currentSubKey = $('sub-chart-select').value;
+
+        $('w-val').innerText = '0';
+        $('l-val').innerText = '0';
+        $('r-val').innerText = d.tgt.c.length;
+        $('res-modal').style.display = 'none';
+        setBtns(false);
+
+        render(idx, true);
+        // 範囲調整
+        const totalVisible = d.ctx.c.length + idx;
+        chart.timeScale().setVisibleLogicalRange({ from: totalVisible - 50, to: totalVisible + 5 });
+    }
+
+    function beep(t) {
+        try {
+            if(!ac) ac=new(window.AudioContext||window.webkitAudioContext)();
+            if(ac.state==='suspended') ac.resume();
+            const o=ac.createOscillator(), g=ac.createGain();
+            o.connect(g); g.connect(ac.destination);
+            const n=ac.currentTime;
+            if(t==='w') { o.freq.setValueAtTime(880,n); o.freq.expRampToValueAtTime(1760,n+.1); g.gain.setValueAtTime(.1,n); g.gain.linRampToValueAtTime(0,n+.4); }
+            else if(t==='l') { o.type='sawtooth'; o.freq.setValueAtTime(150,n); g.gain.setValueAtTime(.1,n); g.gain.linRampToValueAtTime(0,n+.3); }
+            else { o.type='square'; o.freq.setValueAtTime(500,n); g.gain.setValueAtTime(.05,n); g.gain.linRampToValueAtTime(0,n+.1); }
+            o.start(n); o.stop(n+(t==='w'?.4:t==='l'?.3:.1));
+        } catch(e){}
+    }
+
+    async function animateCandle(c) {
+        const sleep = ms => new Promise(r => setTimeout(r, ms));
+        const steps = 8;
+        const wait = 15;
+        const isYang = c.close >= c.open;
+
+        const upd = (o, h, l, cl) => sC.update({ time: c.time, open: o, high: h, low: l, close: cl });
+
+        if (isYang) {
+            // O -> L
+            for(let i=1; i<=steps; i++) {
+                const p = c.open + (c.low - c.open) * (i/steps);
+                upd(c.open, c.open, p, p);
+                await sleep(wait);
+            }
+            // L -> H
+            for(let i=1; i<=steps; i++) {
+                const p = c.low + (c.high - c.low) * (i/steps);
+                // p is current price. H is max(open, p), L is low
+                let curH = Math.max(c.open, p);
+                upd(c.open, curH, c.low, p);
+                await sleep(wait);
+            }
+            // H -> C
+            for(let i=1; i<=steps; i++) {
+                const p = c.high + (c.close - c.high) * (i/steps);
+                upd(c.open, c.high, c.low, p);
+                await sleep(wait);
+            }
+        } else {
+            // O -> H
+            for(let i=1; i<=steps; i++) {
+                const p = c.open + (c.high - c.open) * (i/steps);
+                upd(c.open, p, c.open, p);
+                await sleep(wait);
+            }
+            // H -> L
+            for(let i=1; i<=steps; i++) {
+                const p = c.high + (c.low - c.high) * (i/steps);
+                // p is current price. L is min(open, p)
+                let curL = Math.min(c.open, p);
+                upd(c.open, c.high, curL, p);
+                await sleep(wait);
+            }
+            // L -> C
+            for(let i=1; i<=steps; i++) {
+                const p = c.low + (c.close - c.low) * (i/steps);
+                upd(c.open, c.high, c.low, p);
+                await sleep(wait);
+            }
+        }
+    }
+
+    function setBtns(disabled) {
+        for (const id of ['btn-up', 'btn-skip', 'btn-down']) {
+            $(id).disabled = disabled;
+            $(id).style.opacity = disabled ? 0.5 : 1;
+        }
+    }
+
+    async function playTurn(act) {
+        if(!d || idx >= d.tgt.c.length) return;
+        setBtns(true);
+
+        const next=d.tgt.c[idx];
+        const isUp=next.close>=next.open;
+        let txt='SKIP', col='#9ca3af', snd='s';
+
+        let win=null;
+        if(act!=='skip') {
+            win=(act==='up'&&isUp)||(act==='down'&&!isUp);
+            if(win) { w++; txt='⭕'; col='#34d399'; snd='w'; }
+            else { l++; txt='❌'; col='#f87171'; snd='l'; }
+        }
+        decisions.push({ t: next.time, act: act, up: isUp, win: win });
+        beep(snd);
+
+        const ov=$('ov-anim');
+        ov.innerText=txt; ov.style.color=col;
+        ov.style.transition='none'; ov.style.opacity=1; ov.style.transform='translate(-50%,-50%) scale(1.2)';
+        requestAnimationFrame(()=>{
+            setTimeout(()=>{ ov.style.transition='all 1s ease-out'; ov.style.opacity=0; ov.style.transform='translate(-50%,-50%) scale(0.8)'; }, 50);
+        });
+
+        if (act !== 'skip') {
+           await animateCandle(next);
+        }
+
+        $('w-val').innerText=w;
+        $('l-val').innerText=l;
+
+        idx++;
+        render(idx);
+
+        // 残り回数: ラウンドの足を全部出したら終了
+        $('r-val').innerText = d.tgt.c.length - idx;
+
+        const totalVisible = d.ctx.c.length + idx;
+        chart.timeScale().setVisibleLogicalRange({ from: totalVisible - 50, to: totalVisible + 5 });
+
+        setBtns(false);
+
+        // ラウンド終了判定
+        if(idx >= d.tgt.c.length) {
+            report('round', { attempt: attempt, win: w, lose: l, decisions: decisions });
+            setTimeout(()=>{
+                const total = w + l;
+                // 採点・段階の判定は game_engine.py（accuracy / TIERS）と揃えておくこと
+                const rate = total ? Math.round(w / total * 100) : 0;
+                const sEl = $('score-val');
+                $('msg-val').innerText = MSGS[rate >= 80 ? 'god' : rate >= 60 ? 'pro' : rate >= 40 ? 'normal' : rate >= 20 ? 'bad' : 'disaster'][0];
+                sEl.innerText = rate + '%';
+                sEl.style.color = rate >= 50 ? '#34d399' : '#f87171';
+
+                // ボタン制御
+                $('btn-next').style.display = hasNext ? 'inline-block' : 'none';
+
+                $('res-modal').style.display='flex';
+            }, 1000);
+        }
+    }
+
+    $('btn-up').onclick = () => playTurn('up');
+    $('btn-skip').onclick = () => playTurn('skip');
+    $('btn-down').onclick = () => playTurn('down');
+
+    $('btn-retry').onclick = () => initGame();
+    // 次のラウンドの足は Python から届く（届いたら load から initGame）
+    $('btn-next').onclick = () => {
+        $('res-modal').style.display = 'none';
+        setBtns(true);
+        $('r-val').innerText = '…';
+        report('next');
+    };
+
+    // === データの受け取り ===
+    function setSubData(subRaw, formRaw) {
+        subDMap = {};
+        for (const k in subRaw) subDMap[k] = Object.assign(decodeChart(subRaw[k]), { dz: subRaw[k].dz || 0 });
+        subForming = {};
+        for (const k in formRaw) subForming[k] = decodeForming(formRaw[k]);
+    }
+
+    async function load(args) {
+        if (args.payload_id === payloadId) return;
+        payloadId = args.payload_id;
+        // 展開中に次の引数が届いたら古い方は捨てる
+        const seq = ++loadSeq;
+        const [dRaw, subRaw, formRaw] = await Promise.all(
+            [args.data, args.sub_map, args.sub_forming].map(s => unpack(JSON.parse(s))));
+        if (seq !== loadSeq) return;
+
+        // 同じラウンドでサブチャートだけ変わった（古い履歴を全部要求した）ときは、ゲームの途中状態と表示範囲を保つ
+        if (d && args.game === game && args.round === roundNo && args.data === dataArg) {
+            const range = subChart.timeScale().getVisibleRange();
+            setSubData(subRaw, formRaw);
+            subShown = 0; subForm = null;
+            syncSubChart(true);
+            if (range) subChart.timeScale().setVisibleRange(range);
+            return;
+        }
+        if (args.game !== game) detailAsked = {};
+        dataArg = args.data;
+
+        d = { ctx: decodeChart(dRaw.ctx), tgt: decodeChart(dRaw.tgt) };
+        setSubData(subRaw, formRaw);
+        MSGS = args.messages;
+        game = args.game;
+        roundNo = args.round;
+        hasNext = args.has_next;
+        attempt = 0;
+
+        $('ticker-name').textContent = args.ticker_name;
+        $('ticker-code').textContent = args.ticker_code;
+        $('mode-badge').textContent = String(args.mode).toUpperCase();
+
+        // サブチャートの選択肢（初期選択は先頭。同じ選択肢が残っていれば選択を引き継ぐ）
+        const sel = $('sub-chart-select');
+        const prev = sel.value;
+        sel.innerHTML = '';
+        for (const k of args.sub_keys) {
+            const opt = document.createElement('option');
+            opt.value = k; opt.textContent = k;
+            sel.appendChild(opt);
+        }
+        sel.value = args.sub_keys.includes(prev) ? prev : (args.sub_keys[0] || '');
+
+        chart.applyOptions({ timeScale: args.intraday ? intradayTimeScale : { timeVisible: true, secondsVisible: false, tickMarkFormatter: undefined } });
+        buildSeries(args.lines);
+        mainShown = -1; subShown = 0; subForm = null;
+        initGame();
+        Streamlit.setFrameHeight();
+    }
+
+    Streamlit.onRender(load);
+    Streamlit.setComponentReady();
+    // 画面幅でレイアウトが変わる（スマホ表示）ので高さを追従させる
+    new ResizeObserver(() => Streamlit.setFrameHeight()).observe(document.body);
+    Streamlit.setFrameHeight();
+})();
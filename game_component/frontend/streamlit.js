@@ -0,0 +1,28 @@
+// === Streamlit カスタムコンポーネントの通信（streamlit-component-lib 相当の最小実装） ===
+// 親フレームとは postMessage でやりとりする。ビルド工程を持たないため npm パッケージは使わない
+const Streamlit = (function(){
+    const API_VERSION = 1;
+    let lastHeight = -1;
+
+    function send(type, data) {
+        window.parent.postMessage(Object.assign({ isStreamlitMessage: true, type: type }, data), '*');
+    }
+
+    return {
+        // 読み込み完了を通知すると、以後 streamlit:render で引数が届く
+        setComponentReady() { send('streamlit:componentReady', { apiVersion: API_VERSION }); },
+        setFrameHeight(height) {
+            if (height === undefined) height = document.body.scrollHeight;
+            if (height === lastHeight) return;
+            lastHeight = height;
+            send('streamlit:setFrameHeight', { height: height });
+        },
+        setComponentValue(value) { send('streamlit:setComponentValue', { value: value, dataType: 'json' }); },
+        // 再実行のたびに同じ iframe へ引数が送られてくる（iframe は作り直されない）
+        onRender(cb) {
+            window.addEventListener('message', (e) => {
+                if (e.data && e.data.type === 'streamlit:render') cb(e.data.args || {});
+            });
+        }
+    };
+})();
@@ -0,0 +1,112 @@
+import pandas as pd
+import indicators
+from serialize import serialize_chart, serialize_forming
+from resample import decimate_ohlcv
+from game_engine import ROUND_LEN
+
+# === ゲームに出す足の切り出し ===
+# app.py（画面）と game_engine / バッチ処理の両方から使う。Streamlit には依存しない
+PREDICT_DAYS_DAILY = 20
+PREDICT_BARS_5M = 20
+# 出題の手前に見せる足の本数。ラウンドが進んでも送る量が増えないよう、前のラウンドの足を含めてこの本数に収める
+CONTEXT_BARS = 200
+# サブチャート: 今の足に近い SUB_FULL_BARS 本はそのまま、それより古い履歴は SUB_HISTORY_BARS 本にまとめて送る
+# （画面に並べられる本数で頭打ちにする。スクロールして古い方を見たときだけ全部送り直す）
+SUB_FULL_BARS = 300
+SUB_HISTORY_BARS = 300
+
+def slice_game_frames(df, mode, selected_date_str=None, ind_df=None):
+    # 戻り値: (ctx_df, tgt_df, err)
+    # ind_df: 指標列（compute_indicators の結果）。キャッシュ済みの足データは書き換えず、結合した新しい表を切り出す
+    if ind_df is None: ind_df = indicators.compute(df, indicators.preset_specs(indicators.DEFAULT_PRESETS))
+    return slice_frame(df.join(ind_df).dropna(), mode, selected_date_str)
+
+def slice_frame(df, mode, selected_date_str=None):
+    # 指標を結合済みの表から切り出す（app.py は結合済みの表をキャッシュしておき、日付の変更ではここだけやり直す）
+    ctx_df = pd.DataFrame()
+    tgt_df = pd.DataFrame()
+
+    if mode == 'daily':
+        if len(df) < PREDICT_DAYS_DAILY + 50: return None, None, "データ不足"
+        
+        target_idx = -PREDICT_DAYS_DAILY # Default to latest
+        
+        if selected_date_str:
+            # 日付文字列から該当するIndexを探す (日付以前の直近の日)
+            try:
+                # 指定日以降のデータで一番古いものの位置を探すのが正確だが、
+                # indexは昇順なので、指定日以上(>=)の最初の要素
+                sel_ts = pd.Timestamp(selected_date_str).replace(tzinfo=None)
+                # indexは昇順なので二分探索で位置を取得（dfは全体なので、targetの開始位置はそこになる）
+                start_pos = int(df.index.searchsorted(sel_ts, side='left'))
+                if start_pos < len(df):
+                    # 十分なcontextがあるか確認
+                    if start_pos < 50:
+                        return None, None, "開始日が古すぎます（過去データ不足）"
+                    if start_pos + PREDICT_DAYS_DAILY > len(df):
+                        # 未来すぎる場合は末尾に合わせる
+                        start_pos = len(df) - PREDICT_DAYS_DAILY
+
+                    ctx_df = df.iloc[:start_pos].tail(CONTEXT_BARS)
+                    tgt_df = df.iloc[start_pos:] # 残りは全部（画面に送るのは round_window で切り出した1ラウンド分だけ）
+                else:
+                    return None, None, "指定日のデータがありません"
+            except Exception as e:
+                return None, None, f"日付処理エラー: {e}"
+        else:
+            ctx_df = df.iloc[:-PREDICT_DAYS_DAILY].tail(CONTEXT_BARS)
+            tgt_df = df.iloc[-PREDICT_DAYS_DAILY:]
+
+    elif mode in ['5m', '3m', '1m']:
+        if not selected_date_str: return None, None, "日付未選択"
+        day = pd.Timestamp(selected_date_str)
+        lo, hi = df.index.searchsorted([day, day + pd.Timedelta(days=1)], side='left')
+        tgt_df = df.iloc[lo:hi]
+        if tgt_df.empty: return None, None, "選択日のデータなし"
+        
+        # 選択日の足は全部返す（画面に送るのは round_window で切り出した1ラウンド分だけ）
+        
+        cutoff_time = tgt_df.index[0]
+        ctx_df = df[df.index < cutoff_time].tail(CONTEXT_BARS)
+
+    return ctx_df, tgt_df, None
+
+def round_window(ctx_df, tgt_df, round_no, round_len=ROUND_LEN, context_bars=CONTEXT_BARS):
+    # ラウンド round_no で出題する足と、その手前の足（ctx + 前のラウンドまでの tgt の末尾 context_bars 本）
+    # 戻り値: (ctx_df, tgt_df, 次のラウンドがあるか)
+    last = max(0, (len(tgt_df) - 1) // round_len)
+    start = min(round_no, last) * round_len
+    if start: ctx_df = pd.concat([ctx_df.tail(max(context_bars - start, 0)), tgt_df.iloc[max(start - context_bars, 0):start]])
+    return ctx_df, tgt_df.iloc[start:start + round_len], start + round_len < len(tgt_df)
+
+def build_game_data(ctx_df, tgt_df, mode, lines=None):
+    if lines is None: lines = indicators.preset_lines(indicators.DEFAULT_PRESETS)
+    is_intraday = (mode in ['5m', '3m', '1m'])
+
+    ctx_data = serialize_chart(ctx_df, is_intraday, lines)
+    tgt_data = serialize_chart(tgt_df, is_intraday, lines)
+
+    return {"ctx": ctx_data, "tgt": tgt_data}
+
+def build_sub_data(s_df, main_df, ctx_index, tgt_index, sub_interval, lines, full=False):
+    # サブチャート（指標を結合済みの s_df）をラウンド終了時刻までに切り詰め、メインの各ステップの形成中の足を付ける。
+    # 今の足から遠い履歴は SUB_HISTORY_BARS 本にまとめる（full=True なら全部そのまま）
+    # 戻り値: (chart, forming)。chart["dz"] はまとめた部分の本数
+    # 分足（5分足）はタイムスタンプ（JST->UTC trick）、日足・週足・月足は日付単位
+    is_intraday = sub_interval.endswith("m")
+    n = int(s_df.index.searchsorted(tgt_index[-1], side='right'))
+    # まとめるのは、このラウンドの最初のステップで確定している足より前だけ
+    first_step = ctx_index[-1] if len(ctx_index) else tgt_index[0]
+    first_done = max(0, int(s_df.index.searchsorted(first_step, side='right')) - 1)
+    old = 0 if full else max(0, min(n - SUB_FULL_BARS, first_done))
+    if old <= SUB_HISTORY_BARS: old = 0  # まとめても本数が減らない
+    s_cut, dz = decimate_ohlcv(s_df.iloc[:n], old, SUB_HISTORY_BARS)
+    chart = dict(serialize_chart(s_cut, is_intraday, lines, with_volume=False), dz=dz)
+    forming = serialize_forming(main_df, ctx_index, tgt_index, s_df.index[:n], sub_interval, is_intraday, n_offset=old - dz)
+    return chart, forming
+
+def process_data(df, mode, selected_date_str=None, indicator_labels=indicators.DEFAULT_PRESETS):
+    ind_df = indicators.compute(df, indicators.preset_specs(indicator_labels))
+    ctx_df, tgt_df, err = slice_game_frames(df, mode, selected_date_str, ind_df)
+    if err: return None, err
+    return build_game_data(ctx_df, tgt_df, mode, indicators.preset_lines(indicator_labels)), None
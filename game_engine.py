@@ -0,0 +1,202 @@
+import numpy as np
+
+# === ゲームのルール（画面なしで動かすエンジン） ===
+# フロント（game_component/frontend/game.js）と同じルールで採点する:
+#   - 次の足の始値が見えた状態で up / down / skip を選ぶ
+#   - 次の足が close >= open なら上、それ以外は下。skip は勝ち負けに数えないがターンは進む
+#   - 1ラウンドは ROUND_LEN 本（tgt の残りが足りなければそこまで）
+#   - 正解率 = round(勝ち / (勝ち + 負け) * 100)、判断が1つも無ければ 0
+# 入力は game_data.process_data の戻り値（フロントに送るのと同じ整数化済みデータ）をそのまま使う
+ROUND_LEN = 20
+
+ACTIONS = {"up": 1, "down": -1, "skip": 0}
+
+# 正解率の下限 -> メッセージの段階（上から順に判定）
+TIERS = [(80, "god"), (60, "pro"), (40, "normal"), (20, "bad"), (0, "disaster")]
+
+# 段階ごとのメッセージ（フロントは先頭を表示）
+MESSAGES = {
+    "god": [
+        "未来から来たんですか？", "SECが監視を始めました。", "天才現る。", "バフェットが電話番号を知りたがっています。", "その透視能力、カジノでは使わないで。", "全知全能ですか？"
+    ],
+    "pro": [
+        "素晴らしい！", "目をつぶって発注しても勝てそう。", "働いたら負けですね。", "ウォール街がヘッドハントに来ます。", "完璧な読み。", "芸術的なトレード。"
+    ],
+    "normal": [
+        "コイントスと同じ。", "サルのダーツ投げレベル。", "凡人。", "AIに仕事奪われますよ。", "記憶に残らないトレード。", "プラマイゼロ。"
+    ],
+    "bad": [
+        "養分乙。", "引退をおすすめします。", "画面逆さま？", "勉強代にしては高い。", "定期預金にしましょう。", "アルゴのカモ。"
+    ],
+    "disaster": [
+        "逆にすごい！", "全人類への逆指標。", "PC電源入ってます？", "逆張りすれば億万長者。", "呼吸するように損してますね。", "お祓いに行きましょう。"
+    ]
+}
+
+
+def accuracy(win, lose):
+    total = win + lose
+    # JS の Math.round と同じく .5 は切り上げ
+    return int(np.floor(win / total * 100 + 0.5)) if total else 0
+
+
+def tier(rate):
+    for lo, name in TIERS:
+        if rate >= lo: return name
+
+
+def decode_chart(p):
+    # serialize_chart の送信形式を配列に戻す（frontend/decode.js の decodeChart と同じ値）
+    # up: 陽線（close >= open）。整数のまま比べるので JS 側の判定と必ず一致する
+    ints = {k: np.cumsum(np.asarray(p[k], dtype=np.int64)) for k in ("o", "h", "l", "c")}
+    scale = 10 ** p["pd"]
+    out = {k: v / scale for k, v in ints.items()}
+    out["t"] = (np.cumsum(np.asarray(p["t"], dtype=np.int64)) * p["tu"]).astype('datetime64[s]')
+    out["up"] = ints["c"] >= ints["o"]
+    if "v" in p: out["v"] = np.asarray(p["v"], dtype=float)
+    out["ind"] = {k: np.cumsum(np.asarray(v, dtype=np.int64)) / 10 ** p["ld"][k] for k, v in p.get("ind", {}).items()}
+    return out
+
+
+def game_arrays(data):
+    # ctx と tgt をつないだ配列と、tgt の開始位置・各 tgt 足の陽線フラグ
+    # bars["ind"]: 指標列（build_game_data に渡した lines の列）
+    ctx, tgt = decode_chart(data["ctx"]), decode_chart(data["tgt"])
+    bars = {k: np.concatenate([ctx[k], tgt[k]]) for k in ("t", "o", "h", "l", "c")}
+    bars["ind"] = {k: np.concatenate([ctx["ind"][k], tgt["ind"][k]]) for k in tgt["ind"]}
+    return bars, len(ctx["c"]), tgt["up"]
+
+
+class GameSession:
+    # 1ラウンド分の対局。play() を1ターンずつ呼ぶ（状態を持つボットや検証用）
+    def __init__(self, data, round_len=ROUND_LEN):
+        self.bars, self.offset, self.up = game_arrays(data)
+        self.round_len = round_len
+        self.reset()
+
+    def reset(self, start=0):
+        # start: tgt の何本目からラウンドを始めるか（「次へ」なら前のラウンドの続き）
+        self.start = self.idx = start
+        self.end = min(start + self.round_len, len(self.up))
+        self.win = self.lose = 0
+        self.decisions = []
+        return self
+
+    @property
+    def done(self):
+        return self.idx >= self.end
+
+    def observe(self):
+        # 見えているもの: ctx + 出題済みの tgt の足と、次の足の始値
+        n = self.offset + self.idx
+        obs = {k: v[:n] for k, v in self.bars.items() if k != "ind"}
+        obs["ind"] = {k: v[:n] for k, v in self.bars["ind"].items()}
+        obs["next_open"] = self.bars["o"][n]
+        return obs
+
+    def play(self, act):
+        # 戻り値: 当たり True / 外れ False / 見送り None
+        if self.done: raise ValueError("ラウンドは終了しています")
+        if act not in ACTIONS: raise ValueError(f"不明な判断: {act}")
+        up = bool(self.up[self.idx])
+        win = None if act == "skip" else (act == "up") == up
+        if win is True: self.win += 1
+        elif win is False: self.lose += 1
+        self.decisions.append({"t": str(self.bars["t"][self.offset + self.idx]), "act": act, "up": up, "win": win})
+        self.idx += 1
+        return win
+
+    def run(self, bot):
+        # bot(observe()) -> "up" / "down" / "skip" をラウンド終了まで繰り返す
+        while not self.done:
+            self.play(bot(self.observe()))
+        return self.result()
+
+    def result(self):
+        rate = accuracy(self.win, self.lose)
+        return {"start": self.start, "win": self.win, "lose": self.lose, "rate": rate, "tier": tier(rate),
+                "decisions": self.decisions}
+
+
+def score_rounds(data, actions, round_len=ROUND_LEN):
+    # 全ての開始位置（tgt の 0 .. n - round_len）のラウンドを一度に採点する。
+    # actions: tgt の各足に対する判断（1=up / -1=down / 0=skip）。開始位置によって判断が変わらないボット向け
+    _, _, up = game_arrays(data)
+    return score_actions(up, actions, round_len)
+
+
+def score_actions(up, actions, round_len=ROUND_LEN):
+    a = np.asarray(actions)
+    if len(a) != len(up): raise ValueError("actions の長さが tgt の本数と違います")
+    hit = ((a == 1) & up) | ((a == -1) & ~up)
+    miss = (a != 0) & ~hit
+    n = len(up)
+    starts = np.arange(max(n - round_len, 0) + 1) if n else np.arange(0)
+    ends = np.minimum(starts + round_len, n)
+    # 累積和の差で各ラウンドの勝ち負けを数える
+    cs_hit = np.r_[0, np.cumsum(hit)]
+    cs_miss = np.r_[0, np.cumsum(miss)]
+    win = cs_hit[ends] - cs_hit[starts]
+    lose = cs_miss[ends] - cs_miss[starts]
+    total = win + lose
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.where(total > 0, np.floor(win / total * 100 + 0.5), 0).astype(int)
+    return {"start": starts, "win": win, "lose": lose, "rate": rate}
+
+
+# === 判断ルール（ベクトル化したボット） ===
+# spec = (名前, パラメータ...)  例: ("follow",), ("ma_cross", 5, 25)
+# bot(bars, offset, *params) -> tgt の各足への判断（1 / -1 / 0）。i 本目の判断には i 本目の始値までしか使わない
+BOTS = {}  # 名前 -> (関数, 必要な指標 spec を返す関数)
+
+
+def register_bot(name, needs=None):
+    def deco(fn):
+        BOTS[name] = (fn, needs or (lambda *params: ()))
+        return fn
+    return deco
+
+
+def bot_needs(spec):
+    # 判断に使う指標（indicators の spec）。build_game_data の lines に含めておく
+    return tuple(BOTS[spec[0]][1](*spec[1:]))
+
+
+def bot_actions(spec, bars, offset):
+    fn, _ = BOTS[spec[0]]
+    return fn(bars, offset, *spec[1:])
+
+
+def _prev(x):
+    # 1本前の値（先頭は NaN）
+    return np.r_[np.nan, x[:-1]]
+
+
+@register_bot("follow")
+def follow(bars, offset):
+    # 直前の足と同じ向き（直前の足が無ければ見送り）
+    o, c = _prev(bars["o"])[offset:], _prev(bars["c"])[offset:]
+    return np.where(np.isnan(c), 0, np.where(c >= o, 1, -1))
+
+
+@register_bot("gap")
+def gap(bars, offset):
+    # 窓を開けた方向（始値 > 前の足の終値なら上）。窓なしは見送り
+    diff = bars["o"][offset:] - _prev(bars["c"])[offset:]
+    return np.nan_to_num(np.sign(diff)).astype(int)
+
+
+@register_bot("momentum")
+def momentum(bars, offset, n=3):
+    # 直前 n 本の値動き（直前の終値 - n 本前の終値）の向き
+    c = _prev(bars["c"])
+    base = np.r_[np.full(n, np.nan), c[:-n]]
+    return np.nan_to_num(np.sign(c - base)[offset:]).astype(int)
+
+
+@register_bot("ma_cross", needs=lambda fast, slow: [("sma", fast), ("sma", slow)])
+def ma_cross(bars, offset, fast=5, slow=25):
+    # 直前の足で短期MA >= 長期MA なら上
+    f = _prev(bars["ind"][f"sma_{fast}"])[offset:]
+    s = _prev(bars["ind"][f"sma_{slow}"])[offset:]
+    return np.where(np.isnan(f) | np.isnan(s), 0, np.where(f >= s, 1, -1))
@@ -0,0 +1,50 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+from game_engine import accuracy
+
+# === ゲーム結果の保存 ===
+# フロントから届いたラウンド結果を JSON Lines で追記する（1行 = 1ラウンド）
+RESULTS_PATH = os.environ.get(
+    "STOCK_RESULTS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "results.jsonl"),
+)
+
+_lock = threading.Lock()
+
+
+def record(result, path=RESULTS_PATH):
+    # 戻り値: エラーメッセージ（成功時は None）
+    row = dict(result, played_at=datetime.now().isoformat(timespec='seconds'))
+    line = json.dumps(row, ensure_ascii=False, separators=(',', ':'))
+    try:
+        with _lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+    except OSError as e:
+        return f"結果の保存に失敗: {e}"
+    return None
+
+
+def load(path=RESULTS_PATH, ticker=None):
+    if not os.path.exists(path): return []
+    rows = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # 書きかけの行は読み飛ばす
+                continue
+            if ticker is None or row.get("ticker") == ticker:
+                rows.append(row)
+    return rows
+
+
+def summarize(rows):
+    win = sum(r.get("win", 0) for r in rows)
+    lose = sum(r.get("lose", 0) for r in rows)
+    return {"rounds": len(rows), "win": win, "lose": lose, "rate": accuracy(win, lose)}
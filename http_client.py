@@ -0,0 +1,124 @@
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import rate_limit
+import shared_cache
+import tracing
+
+# === 共通HTTPクライアント（スクレイピング用） ===
+# - Session を共有して接続を使い回す（毎回 TCP/TLS を張り直さない）
+# - ホストごとの同時接続数を制限し、枠が空かなければ待ちすぎずに諦める
+#   （毎秒の回数と優先度順の順番待ちは rate_limit。429 を受けたらそのホストを backoff させる）
+# - タイムアウトは (接続, 読み込み) とも上限あり、429/5xx と通信エラーはジッター付きで再試行
+# - 取得したページ（HTML）そのものは覚えない。覚えるのは memoize で解析した結果（銘柄名・検索結果）だけで、
+#   成功・失敗とも TTL 付き（失敗は短め）。Streamlit の再実行をまたいで効くようモジュールに持ち、
+#   shared_cache でプロセス間でも共有する
+# - requests は最初の取得のときに import する（マスタがあれば検索・銘柄名で一度も使わないので、起動時に読まない）
+HEADERS = {"User-Agent": "Mozilla/5.0"}
+TIMEOUT = (3.05, 5)
+MAX_PER_HOST = 4
+SLOT_WAIT = 5
+RETRIES = 2
+BACKOFF = 0.5
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+OK_TTL = 3600
+FAIL_TTL = 300
+
+
+class TTLCache:
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        # 戻り値: (ヒットしたか, 値)
+        with self.lock:
+            hit = self.data.get(key)
+            if hit is None: return False, None
+            if hit[0] <= time.monotonic():
+                del self.data[key]
+                return False, None
+            return True, hit[1]
+
+    def put(self, key, value, ttl):
+        with self.lock:
+            self.data.pop(key, None)
+            if len(self.data) >= self.maxsize:
+                # 古いものから捨てる（dict は挿入順）
+                del self.data[next(iter(self.data))]
+            self.data[key] = (time.monotonic() + ttl, value)
+
+
+_session = None
+_session_lock = threading.Lock()
+_host_slots = {}
+_memo = TTLCache()
+
+
+def _get_session():
+    global _session
+    import requests
+    from requests.adapters import HTTPAdapter
+    with _session_lock:
+        if _session is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=MAX_PER_HOST)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            s.headers.update(HEADERS)
+            _session = s
+        return _session
+
+
+def _host_slot(host):
+    with _session_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(MAX_PER_HOST)
+        return _host_slots[host]
+
+
+def fetch_text(url):
+    """(text, err) を返す。結果はキャッシュしない（呼び出し側が解析結果を memoize する）。"""
+    import requests
+    host = urlsplit(url).netloc
+    slot = _host_slot(host)
+    err = None
+    for attempt in range(RETRIES + 1):
+        if attempt:
+            time.sleep(BACKOFF * 2 ** (attempt - 1) * (0.5 + random.random()))
+        if not rate_limit.acquire(host) or not slot.acquire(timeout=SLOT_WAIT):
+            return None, "混雑のためスキップ"
+        try:
+            with tracing.span("http.get", host=host, attempt=attempt):
+                res = _get_session().get(url, timeout=TIMEOUT)
+                tracing.note(status=res.status_code, bytes=len(res.content))
+        except requests.RequestException as e:
+            err = f"通信エラー: {e}"
+            continue
+        finally:
+            slot.release()
+        if res.status_code in RETRY_STATUS:
+            if res.status_code == 429: rate_limit.throttled(host)
+            err = f"HTTP {res.status_code}"
+            continue
+        if res.status_code != 200:
+            return None, f"HTTP {res.status_code}"
+        rate_limit.ok(host)
+        if not res.encoding or res.encoding.lower() == 'iso-8859-1':
+            res.encoding = res.apparent_encoding
+        return res.text, None
+    return None, err
+
+
+def memoize(key, fn, ttl=OK_TTL, fail_ttl=FAIL_TTL):
+    """fn() -> (value, err) の結果を key で TTL キャッシュし、value を返す。"""
+    hit, value = _memo.get(key)
+    if hit: return value
+    # プロセス間で共有するキャッシュ（ディスク）を引き、無ければどれか1つのプロセスだけが fn を実行する
+    value, left = shared_cache.memoize(key, fn, ttl, fail_ttl)
+    _memo.put(key, value, left)
+    return value
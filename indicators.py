@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+
+# === テクニカル指標 ===
+# spec = (名前, パラメータ...)  例: ("sma", 25), ("bb", 20, 2.0)
+# 足データ（DataFrame）を書き換えず、指標列だけの DataFrame を返す。
+# 同じ (銘柄, 足種, spec) の結果は app.compute_indicators でセッションをまたいでキャッシュする
+INDICATORS = {}  # 名前 -> (関数, 出力列のサフィックス)
+
+
+def register(name, outputs=("",)):
+    def deco(fn):
+        INDICATORS[name] = (fn, outputs)
+        return fn
+    return deco
+
+
+def spec_key(spec):
+    return "_".join(str(p) for p in spec)
+
+
+def columns(spec):
+    _, outputs = INDICATORS[spec[0]]
+    base = spec_key(spec)
+    return [f"{base}_{s}" if s else base for s in outputs]
+
+
+def _rolling_mean(x, n):
+    out = np.full(len(x), np.nan)
+    if len(x) >= n:
+        cs = np.cumsum(np.insert(x, 0, 0.0))
+        out[n - 1:] = (cs[n:] - cs[:-n]) / n
+    return out
+
+
+def _rolling_std(x, n):
+    out = np.full(len(x), np.nan)
+    if len(x) >= n:
+        out[n - 1:] = np.lib.stride_tricks.sliding_window_view(x, n).std(axis=1)
+    return out
+
+
+@register("sma")
+def sma(bars, period):
+    return [_rolling_mean(bars['Close'], period)]
+
+
+@register("ema")
+def ema(bars, period):
+    return [pd.Series(bars['Close']).ewm(span=period, adjust=False, min_periods=period).mean().to_numpy()]
+
+
+@register("bb", outputs=("mid", "up", "lo"))
+def bollinger(bars, period=20, k=2.0):
+    mid = _rolling_mean(bars['Close'], period)
+    std = _rolling_std(bars['Close'], period)
+    return [mid, mid + k * std, mid - k * std]
+
+
+@register("rsi")
+def rsi(bars, period=14):
+    diff = np.diff(bars['Close'], prepend=np.nan)
+    # Wilder の平滑化（alpha = 1/period）
+    gain = pd.Series(np.where(diff > 0, diff, 0.0)).ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
+    loss = pd.Series(np.where(diff < 0, -diff, 0.0)).ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = 100 - 100 / (1 + gain.to_numpy() / loss.to_numpy())
+    out[0] = np.nan
+    return [out]
+
+
+@register("vwap")
+def vwap(bars):
+    # 日ごとにリセットする累積VWAP（日足以上では典型価格と同じになる）
+    tp = (bars['High'] + bars['Low'] + bars['Close']) / 3
+    pv = np.cumsum(tp * bars['Volume'])
+    vol = np.cumsum(bars['Volume'])
+    day = bars['Day']
+    starts = np.flatnonzero(np.r_[True, day[1:] != day[:-1]])
+    # 各足が属する日の開始位置までの累積を差し引く
+    first = np.repeat(starts, np.diff(np.r_[starts, len(day)]))
+    base_pv = np.where(first > 0, pv[first - 1], 0.0)
+    base_vol = np.where(first > 0, vol[first - 1], 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = (pv - base_pv) / (vol - base_vol)
+    return [np.where(np.isfinite(out), out, tp)]
+
+
+@register("vma")
+def volume_ma(bars, period):
+    return [_rolling_mean(bars['Volume'], period)]
+
+
+def compute(df, specs):
+    bars = {c: df[c].to_numpy(dtype=float) for c in ['Open', 'High', 'Low', 'Close', 'Volume']}
+    bars['Day'] = df.index.normalize().asi8
+    out = {}
+    for spec in specs:
+        fn, _ = INDICATORS[spec[0]]
+        for col, values in zip(columns(spec), fn(bars, *spec[1:])):
+            out[col] = values
+    return pd.DataFrame(out, index=df.index)
+
+
+# === チャートで選べる指標 ===
+# ラベル -> (spec, 色, 表示先スケール)。price: ローソク足と同じ / volume: 出来高 / osc: 0-100 の別スケール
+PRESETS = {
+    "MA5": (("sma", 5), '#facc15', 'price'),
+    "MA25": (("sma", 25), '#34d399', 'price'),
+    "MA75": (("sma", 75), '#a855f7', 'price'),
+    "EMA20": (("ema", 20), '#60a5fa', 'price'),
+    "BB20": (("bb", 20, 2.0), '#f472b6', 'price'),
+    "VWAP": (("vwap",), '#fb923c', 'price'),
+    "出来高MA25": (("vma", 25), '#9ca3af', 'volume'),
+    "RSI14": (("rsi", 14), '#38bdf8', 'osc'),
+}
+DEFAULT_PRESETS = ("MA5", "MA25", "MA75")
+
+
+def preset_specs(labels):
+    return tuple(PRESETS[k][0] for k in labels)
+
+
+def preset_lines(labels):
+    # 描画する線の一覧 [{key, color, scale}]（serialize_chart / JS 側で使う）
+    return [{"key": col, "color": color, "scale": scale}
+            for spec, color, scale in (PRESETS[k] for k in labels)
+            for col in columns(spec)]
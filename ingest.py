@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+import company_master
+import market_data
+import rate_limit
+import shared_cache
+from market_data import (FETCH_PERIODS, THROTTLED, adjusted_since, diff_start, download, normalize_frame, read_index,
+                         read_store, save_bars)
+
+# === 銘柄の一括取り込み（アプリが読む保存データを前もって作る） ===
+# 初めて見られる銘柄でもその場のダウンロードを待たせないよう、上場銘柄の日足・分足を保存データ
+# （market_data.STORE_DIR）に取り込む。アプリ・backtest.py はそのまま差分取得から始められる。
+# - 差分の開始日が同じ銘柄を --batch 件ずつまとめて1回の yf.download（複数銘柄）で取り、バッチは --workers 本で並列に流す
+# - 取り込む足は fetch_raw_data と同じ列の検査（normalize_frame）を通し、保存済みの足に繋いで書き出す
+# - 終わった (足種, 銘柄) はチェックポイントに書くので、止めても同じコマンドで続きから再開できる（全部終われば消す）
+# - 上流への取得は rate_limit（1銘柄 = 1回）を通す。--rps で yfinance への毎秒の回数を変えられる
+# 分足は yfinance で遡れる期間（1分足 7日・5分足 60日）だけ。取れない銘柄は「データなし」として飛ばす
+# 例: python ingest.py --master                  （マスタの全銘柄、日足・5分足・1分足）
+#     python ingest.py 7203.T 6758.T --intervals 1d
+INTERVALS = ("1d", "5m", "1m")
+BATCH = 50
+WORKERS = 4
+CHECKPOINT_PATH = os.path.join(market_data.STORE_DIR, "ingest.checkpoint.json")
+
+
+class Checkpoint:
+    def __init__(self, path=CHECKPOINT_PATH, fresh=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = {}  # 足種 -> {銘柄: 取り込んだ時刻}
+        if fresh or not os.path.exists(path): return
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.done = json.load(f).get("done", {})
+        except (OSError, ValueError):
+            pass
+
+    def is_done(self, interval, ticker):
+        return ticker in self.done.get(interval, {})
+
+    def mark(self, interval, tickers):
+        if not tickers: return
+        with self.lock:
+            now = time.time()
+            self.done.setdefault(interval, {}).update(dict.fromkeys(tickers, now))
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({"done": self.done}, separators=(',', ':')))
+            os.replace(tmp, self.path)
+
+    def finish(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def plan_batches(tickers, interval, batch=BATCH):
+    # 差分の開始日（全期間なら None）が同じ銘柄を batch 件ずつまとめる。戻り値: [(開始日, [銘柄])]
+    # 保存データの最終足は索引から引く（足データ本体は読まない）
+    groups = {}
+    for ticker in tickers:
+        meta = read_index(ticker, interval)
+        start = diff_start(pd.Timestamp(meta["last"]) if meta else None, interval, previous_day(meta))
+        groups.setdefault(start, []).append(ticker)
+    return [(start, group[i:i + batch]) for start, group in groups.items() for i in range(0, len(group), batch)]
+
+
+def previous_day(meta):
+    # 索引から最終足の1本前の足の日付（差分の重なりに確定済みの足を含めるため）
+    if not meta or not meta["dates"]: return None
+    if meta["counts"][-1] > 1: return pd.Timestamp(meta["dates"][-1])
+    return pd.Timestamp(meta["dates"][-2]) if len(meta["dates"]) > 1 else None
+
+
+def split_frame(df, ticker):
+    # 複数銘柄の yf.download（group_by='ticker'）から1銘柄分を取り出す。他の銘柄だけにある日時（全列欠損）は落とす
+    if df is None or df.empty: return None
+    if isinstance(df.columns, pd.MultiIndex):
+        key = ticker.upper()
+        if key not in df.columns.get_level_values(0): return None
+        df = df[key]
+    return df.dropna(how='all')
+
+
+def ingest_batch(interval, start, tickers):
+    # 戻り値: {銘柄: None（取り込んだ） / "データなし"（取れる足が無い） / エラー}
+    import yfinance as yf
+    bucket = rate_limit.bucket(rate_limit.YF_HOST)
+    throttled = bucket.stats["throttled"]
+    for _ in tickers:
+        # yf.download は銘柄ごとに1回ずつ問い合わせる
+        if not rate_limit.acquire(rate_limit.YF_HOST, timeout=3600):
+            return dict.fromkeys(tickers, "混雑のため取得を見送りました")
+    when = {"period": FETCH_PERIODS[interval]} if start is None else {"start": start}
+    try:
+        df = yf.download(tickers, interval=interval, group_by='ticker', threads=True,
+                         progress=False, auto_adjust=False, **when)
+    except Exception as e:
+        return dict.fromkeys(tickers, f"エラー: {e}")
+    if bucket.stats["throttled"] > throttled:
+        # アクセス制限で空になった銘柄を「データなし」で済ませない（次の実行で取り直す）
+        limited = THROTTLED
+    else:
+        limited = None
+
+    results = {}
+    fetched = time.time()
+    for ticker in tickers:
+        new, err = normalize_frame(split_frame(df, ticker))
+        if err:
+            # アクセス制限で空になったものは取り直す。差分が空（休場日など）なら保存データのままで足りる
+            results[ticker] = limited or (None if err == "データなし" and start is not None else err)
+            continue
+        with shared_cache.file_lock(("bars", ticker, interval)):
+            stored = read_store(ticker, interval)
+            if stored is not None and not stored.empty and adjusted_since(stored, new):
+                # 分割・配当で過去の足が調整し直された。この銘柄だけ全期間を取り直して置き換える
+                new, err = download(ticker, interval, period=FETCH_PERIODS[interval])
+                if err:
+                    results[ticker] = err
+                    continue
+                stored = None
+            save_bars(ticker, interval, stored, new, fetched)
+        results[ticker] = None
+    return results
+
+
+def run(tickers, intervals=INTERVALS, batch=BATCH, workers=WORKERS, checkpoint=None):
+    # 戻り値: (取り込んだ数, 飛ばした {(足種, 銘柄): 理由}, 失敗した {(足種, 銘柄): エラー})
+    checkpoint = checkpoint or Checkpoint()
+    job = rate_limit.prioritized(rate_limit.BACKGROUND, ingest_batch)
+    done, skipped, errors = 0, {}, {}
+    for interval in intervals:
+        todo = [t for t in tickers if not checkpoint.is_done(interval, t)]
+        batches = plan_batches(todo, interval, batch)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(job, interval, start, group) for start, group in batches]
+            for i, fut in enumerate(as_completed(futures), 1):
+                results = fut.result()
+                ok = [t for t, err in results.items() if err is None]
+                empty = [t for t, err in results.items() if err == "データなし"]
+                # 取れる足が無い銘柄も済みにする（分足の無い銘柄を毎回問い合わせない）
+                checkpoint.mark(interval, ok + empty)
+                done += len(ok)
+                skipped.update({(interval, t): "データなし" for t in empty})
+                errors.update({(interval, t): err for t, err in results.items() if err not in (None, "データなし")})
+                print(f"[{interval} {i}/{len(batches)}] {len(ok)}/{len(results)} 銘柄を取り込みました", flush=True)
+    if not errors: checkpoint.finish()
+    return done, skipped, errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="銘柄の日足・分足を一括で取得して保存データに取り込む（再開可能）")
+    parser.add_argument("tickers", nargs="*", help="例: 7203.T")
+    parser.add_argument("--file", help="銘柄コードを1行1つ書いたファイル")
+    parser.add_argument("--master", action="store_true", help="銘柄マスタ（data/companies.csv）の全銘柄")
+    parser.add_argument("--intervals", default=",".join(INTERVALS), help="カンマ区切り（1d, 5m, 1m）")
+    parser.add_argument("--batch", type=int, default=BATCH, help="1回の yf.download にまとめる銘柄数")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--rps", type=float, help="yfinance への毎秒の問い合わせ回数（既定は rate_limit.RATES）")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--fresh", action="store_true", help="チェックポイントを無視して最初からやり直す")
+    args = parser.parse_args()
+
+    tickers = company_master.read_tickers(args.tickers, args.file, args.master)
+    if not tickers: parser.error("銘柄を指定してください")
+    intervals = [iv.strip() for iv in args.intervals.split(",") if iv.strip()]
+    unknown = [iv for iv in intervals if iv not in FETCH_PERIODS]
+    if unknown: parser.error(f"未対応の足種: {', '.join(unknown)}（{', '.join(FETCH_PERIODS)}）")
+    if args.rps:
+        rate_limit.RATES = dict(rate_limit.RATES, **{rate_limit.YF_HOST: (args.rps, max(1, int(args.rps * 2)))})
+        rate_limit.reset()
+
+    t0 = time.perf_counter()
+    done, skipped, errors = run(tickers, intervals, args.batch, args.workers, Checkpoint(args.checkpoint, args.fresh))
+    print(f"\n{done} 件を取り込みました（{len(tickers)} 銘柄 × {len(intervals)} 足種、{time.perf_counter() - t0:.0f} 秒）")
+    if skipped: print(f"データなし {len(skipped)} 件")
+    if errors:
+        print(f"失敗 {len(errors)} 件: " + ", ".join(f"{t} {iv}（{e}）" for (iv, t), e in list(errors.items())[:10]))
+        print(f"同じコマンドで続きから再開できます（チェックポイント: {args.checkpoint}）")
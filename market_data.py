@@ -0,0 +1,316 @@
+import json
+import logging
+import os
+import re
+import time
+import numpy as np
+import pandas as pd
+
+import rate_limit
+from resample import SOURCE_INTERVAL
+import shared_cache
+import tracing
+
+# === ローカル保存先 ===
+# ticker × interval ごとに Parquet で保存し、2回目以降は差分だけダウンロードする
+STORE_DIR = os.environ.get(
+    "STOCK_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "ohlcv"),
+)
+
+REQUIRED_COLS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# 取得元の足ごとの取得期間（1分足は7日、5分足は60日がyfinanceの上限）
+FETCH_PERIODS = {"1d": "10y", "5m": "60d", "1m": "7d"}
+
+def main_source(interval):
+    # メインチャートの足 interval を作る取得元の足（取得できる足はそのまま、3分足は1分足、週足・月足は日足）
+    return interval if interval in FETCH_PERIODS else SOURCE_INTERVAL.get(interval, interval)
+
+
+def sub_source(interval, base):
+    # サブチャートの足 interval の取得元。日足以上は日足から、分足はメインの取得元 base から作る
+    # （1ページあたりの取得は base + 日足の最大2種類で済む）
+    return "1d" if interval == "1d" or SOURCE_INTERVAL.get(interval) == "1d" else base
+
+
+# yfinance で取得できる分足の遡り上限（日数）。これより古い保存データからは差分取得できない
+INTRADAY_LIMIT_DAYS = {"1m": 7, "2m": 60, "5m": 60, "15m": 60, "30m": 60, "90m": 60, "60m": 730, "1h": 730}
+
+# 最後に取りに行ってからこの秒数以内なら、保存データをそのまま使う（複数プロセスで同じ銘柄を取り直さない）
+FRESH_SECONDS = float(os.environ.get("STOCK_FRESH_SECONDS", "300"))
+
+# 差分と保存データの重なる足で、終値・調整後終値がこれ以上（相対）ずれていたら過去の足が調整し直されたとみなす
+ADJUST_TOLERANCE = 1e-3
+
+
+def store_path(ticker, interval):
+    safe = re.sub(r'[^0-9A-Za-z._-]', '_', ticker)
+    return os.path.join(STORE_DIR, interval, f"{safe}.parquet")
+
+
+def read_store(ticker, interval):
+    path = store_path(ticker, interval)
+    if not os.path.exists(path): return None
+    try:
+        return pd.read_parquet(path)
+    except Exception:
+        # 壊れたファイルは無視して取り直す
+        return None
+
+
+def write_store(ticker, interval, df):
+    path = store_path(ticker, interval)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 書きかけのファイルを他プロセスが読まないよう、一時ファイル経由で置き換える
+        tmp = f"{path}.{os.getpid()}.tmp"
+        df.to_parquet(tmp)
+        os.replace(tmp, path)
+    except Exception:
+        # 保存に失敗してもデータ自体は返せるので握りつぶす（読み取り専用環境など）
+        pass
+
+
+def normalize_frame(df):
+    if df is None or df.empty: return None, "データなし"
+
+    if isinstance(df.columns, pd.MultiIndex):
+        try: df.columns = df.columns.get_level_values(0)
+        except Exception: pass
+
+    if not all(c in df.columns for c in REQUIRED_COLS): return None, "データ不足"
+
+    if not isinstance(df.index, pd.DatetimeIndex):
+        df.index = pd.to_datetime(df.index)
+
+    # タイムゾーン処理: 日本時間に変換してTimeZone情報を削除（Naiveにする）
+    if df.index.tz is not None:
+        df.index = df.index.tz_convert('Asia/Tokyo').tz_localize(None)
+
+    df.index.name = 'Datetime'
+    return df, None
+
+
+THROTTLED = "アクセス制限のため取得できませんでした"
+
+
+def rate_limited(error):
+    # yfinance が絞られたときのエラーか（YFRateLimitError / HTTP 429）
+    text = f"{type(error).__name__}: {error}"
+    return "RateLimit" in text or "Rate limit" in text or "Too Many Requests" in text
+
+
+class _ThrottleWatch(logging.Handler):
+    # yf.download は取得エラーを例外にせずログに出すだけなので、ログからアクセス制限を拾って backoff させる
+    def emit(self, record):
+        if rate_limited(record.getMessage()): rate_limit.throttled(rate_limit.YF_HOST)
+
+
+logging.getLogger("yfinance").addHandler(_ThrottleWatch(logging.ERROR))
+
+
+def download(ticker, interval, period=None, start=None):
+    # 取得は rate_limit の順番待ちを通す。待ちきれなければ取得せずにエラーを返す（保存データがあればそれで続行される）
+    # yfinance は読み込みが重い（約1秒）ので、起動時ではなく最初の取得のときに import する
+    import yfinance as yf
+    if not rate_limit.acquire(rate_limit.YF_HOST): return None, "混雑のため取得を見送りました"
+    bucket = rate_limit.bucket(rate_limit.YF_HOST)
+    throttled = bucket.stats["throttled"]
+    with tracing.span("yfinance.download", ticker=ticker, interval=interval, kind="full" if start is None else "diff"):
+        if start is not None:
+            df = yf.download(ticker, start=start, interval=interval, progress=False, auto_adjust=False)
+        else:
+            df = yf.download(ticker, period=period, interval=interval, progress=False, auto_adjust=False)
+        tracing.note(rows=0 if df is None else len(df))
+    if df is not None and not df.empty: rate_limit.ok(rate_limit.YF_HOST)
+    elif bucket.stats["throttled"] > throttled:
+        # 制限されると yf.download はログを出して空の表を返す。休場日の空の差分（取得できた）と区別する
+        return None, THROTTLED
+    return normalize_frame(df)
+
+
+def merge_bars(stored, new):
+    # 重複する足（当日の未確定足など）は新しく取得した方で上書きする
+    merged = pd.concat([stored, new])
+    merged = merged[~merged.index.duplicated(keep='last')]
+    return merged.sort_index()
+
+
+def period_cutoff(period, interval, days=()):
+    # period の範囲の始まり（この日時以降を残す）。None なら全期間。days: 分足の取引日（昇順、日付単位）
+    if period == "max": return None
+    m = re.match(r'^(\d+)(d|wk|mo|y)$', period)
+    if not m: return None
+    n, unit = int(m.group(1)), m.group(2)
+
+    if unit == 'd' and interval in INTRADAY_LIMIT_DAYS:
+        # 分足の "7d" などは営業日数として扱う（直近N日分の取引日を残す）
+        return days[-min(n, len(days))] if len(days) else None
+
+    offsets = {'d': pd.DateOffset(days=n), 'wk': pd.DateOffset(weeks=n),
+               'mo': pd.DateOffset(months=n), 'y': pd.DateOffset(years=n)}
+    return pd.Timestamp.now(tz='Asia/Tokyo').tz_localize(None).normalize() - offsets[unit]
+
+
+def trim_to_period(df, period, interval):
+    if df is None or df.empty: return df
+    days = df.index.normalize().unique() if interval in INTRADAY_LIMIT_DAYS else ()
+    cutoff = period_cutoff(period, interval, days)
+    return df if cutoff is None else df[df.index >= cutoff]
+
+
+# === 保存データの索引（日付選択用） ===
+# 足データを読まずに「どの日の足があるか」を答えるため、Parquet の隣に小さな JSON を置く。
+#   {"first", "last": 最初・最後の足の日時, "bars": 本数, "dates": 取引日の昇順, "counts": 日ごとの本数}
+# 保存データを更新するたびに作り直す。書き込めない環境でもプロセス内には持っておく
+_index = {}  # (ticker, interval) -> (ファイルの更新時刻, 索引)
+
+
+def index_path(ticker, interval):
+    return store_path(ticker, interval)[:-len(".parquet")] + ".index.json"
+
+
+def build_index(index):
+    days, counts = np.unique(index.values.astype('datetime64[D]'), return_counts=True)
+    return {"first": index[0].isoformat(), "last": index[-1].isoformat(), "bars": int(len(index)),
+            "dates": np.datetime_as_string(days).tolist(), "counts": counts.tolist()}
+
+
+def update_index(ticker, interval, index, fetched=None):
+    # fetched: 最後にダウンロードを試みて成功した時刻（time.time()）。索引を作り直すだけなら前の値を引き継ぐ
+    meta = build_index(index)
+    if fetched is None:
+        old = _index.get((ticker, interval))
+        fetched = old[1].get("fetched") if old is not None else None
+    if fetched is not None: meta["fetched"] = fetched
+    path = index_path(ticker, interval)
+    mtime = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(meta, separators=(',', ':')))
+        os.replace(tmp, path)
+        mtime = os.path.getmtime(path)
+    except OSError:
+        pass
+    _index[(ticker, interval)] = (mtime, meta)
+    return meta
+
+
+def read_index(ticker, interval):
+    # 他プロセスが保存データを更新していれば読み直す。索引が無い古い保存データはインデックス列だけ読んで作る
+    path = index_path(ticker, interval)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+    cached = _index.get((ticker, interval))
+    if cached is not None and (mtime is None or cached[0] == mtime): return cached[1]
+    if mtime is not None:
+        try:
+            with open(path, encoding='utf-8') as f:
+                meta = json.load(f)
+            _index[(ticker, interval)] = (mtime, meta)
+            return meta
+        except (OSError, ValueError):
+            pass
+    store = store_path(ticker, interval)
+    if not os.path.exists(store): return None
+    try:
+        index = pd.read_parquet(store, columns=[]).index
+    except Exception:
+        return None
+    return update_index(ticker, interval, index) if len(index) else None
+
+
+def stale(ticker, interval):
+    """保存データが FRESH_SECONDS 以内に取得できたものでなければ True（混雑・通信エラーで古いまま使ったときなど）。"""
+    meta = read_index(ticker, interval)
+    return meta is None or time.time() - meta.get("fetched", 0) >= FRESH_SECONDS
+
+
+def diff_start(last, interval, prev=None):
+    # 保存データの最終足 last（とその1本前 prev）からの差分取得の開始日（'YYYY-MM-DD'）。
+    # 保存データが無い・古すぎるなら None（全期間を取り直す）
+    if last is None: return None
+    limit = INTRADAY_LIMIT_DAYS.get(interval)
+    now = pd.Timestamp.now(tz='Asia/Tokyo').tz_localize(None)
+    # 分足は遡れる日数に上限があるので、古すぎる保存データからは差分を繋げられない
+    if limit and last < now - pd.Timedelta(days=limit - 1): return None
+    # 1本前の足の日付から取り直す。最終足（当日の未確定足かもしれない）を確定値で上書きし、
+    # 確定済みの足が重なるようにして分割・配当の遡及調整を adjusted_since で見つける
+    return (last if prev is None else prev).strftime('%Y-%m-%d')
+
+
+def adjusted_since(stored, new):
+    # 重なる確定済みの足（保存データの最終足を除く）で終値・調整後終値が食い違うか。
+    # yfinance は分割・配当のたびに過去の足を遡って調整するので、食い違えば保存データは古い基準のまま
+    common = stored.index[:-1].intersection(new.index)
+    if not len(common): return False
+    for col in ('Close', 'Adj Close'):
+        if col not in stored.columns or col not in new.columns: continue
+        a = stored.loc[common, col].to_numpy(dtype=float)
+        b = new.loc[common, col].to_numpy(dtype=float)
+        ok = np.isfinite(a) & np.isfinite(b)
+        if np.any(np.abs(a[ok] - b[ok]) > ADJUST_TOLERANCE * np.abs(b[ok])): return True
+    return False
+
+
+def save_bars(ticker, interval, stored, new, fetched=None):
+    # 取得した足を保存データに繋いで書き出し、索引も更新する。戻り値: 繋いだ後の df
+    df = merge_bars(stored, new) if stored is not None and not stored.empty else new
+    write_store(ticker, interval, df)
+    update_index(ticker, interval, df.index, fetched)
+    return df
+
+
+def load_bars(ticker, period, interval):
+    """保存済みデータ + 差分ダウンロードで (df, err) を返す。"""
+    # 同じ銘柄・足の取得はプロセスをまたいで1つずつ。待っていた側は先の取得が保存したデータを読む
+    with shared_cache.file_lock(("bars", ticker, interval)):
+        return _load_bars(ticker, period, interval)
+
+
+def _load_bars(ticker, period, interval):
+    stored = read_store(ticker, interval)
+    if stored is not None and not stored.empty:
+        meta = read_index(ticker, interval)
+        if meta is not None and time.time() - meta.get("fetched", 0) < FRESH_SECONDS:
+            df = trim_to_period(stored, period, interval)
+            if df is not None and not df.empty: return df, None
+    has_stored = stored is not None and not stored.empty
+    start = diff_start(stored.index[-1] if has_stored else None, interval,
+                       stored.index[-2] if has_stored and len(stored) > 1 else None)
+
+    try:
+        if start is None:
+            new, err = download(ticker, interval, period=period)
+        else:
+            new, err = download(ticker, interval, start=start)
+            if new is not None and adjusted_since(stored, new):
+                # 分割・配当で過去の足が調整し直された。継ぎ足すと段差が残るので全期間を取り直して置き換える
+                tracing.note(adjusted=True)
+                new, err = download(ticker, interval, period=period)
+                if new is not None: stored = None
+    except Exception as e:
+        # 通信エラー時は保存済みデータがあればそれで続行する（stale() が True のまま）
+        if not has_stored: return None, f"エラー: {e}"
+        new, err = None, None
+
+    # 差分が空（休場日など）も取得できたうちに入れる。見送り・アクセス制限は入れない（次の表示で取り直す）
+    fetched = time.time() if new is not None or err == "データなし" else None
+    if new is not None:
+        df = save_bars(ticker, interval, stored, new, fetched)
+    elif stored is not None and not stored.empty:
+        # 差分が空（休場日など）・取得を見送った・制限された場合は保存済みデータをそのまま使う。
+        # 見送り・制限のときは fetched を更新しないので、呼び出し側は stale() で古いままかを見分けられる
+        df = stored
+        if fetched is not None or read_index(ticker, interval) is None: update_index(ticker, interval, df.index, fetched)
+    else:
+        return None, err
+
+    df = trim_to_period(df, period, interval)
+    if df is None or df.empty: return None, "データなし"
+    return df, None
@@ -0,0 +1,80 @@
+import argparse
+import os
+import threading
+import time
+
+import rate_limit
+import tracing
+from market_data import FETCH_PERIODS, load_bars
+
+# === 先温め（ウォッチリストの足データを、利用者が来る前に用意しておく） ===
+# デプロイ・スケールアウト直後のプロセスでも、最初の表示で yfinance からの全期間取得を待たせないよう、
+# よく見られる銘柄の日足・5分足・1分足を取得して保存データ（全プロセス共通）とプロセス内のキャッシュに載せる。
+# - アプリからは start(warm) で裏のスレッドを1本だけ起動し、EVERY 秒ごとに取得し直す（0 なら起動時の1回だけ）
+#   Streamlit はセッションが来るまでスクリプトを実行しないので、スレッドが動き出すのは最初のセッションから
+# - デプロイ・スケールアウトのフックでは python prewarm.py を実行する。最初のセッションより前に保存データ
+#   （全プロセス共通）が温まり、アプリ側は差分取得だけで済む
+# 上流への取得は BACKGROUND 優先度で並ぶので、利用者の表示を邪魔しない
+# STOCK_PREWARM: カンマ区切りの銘柄（空にすると無効）。既定は初期表示の銘柄 + 売買代金上位の常連
+DEFAULT_WATCHLIST = "7203.T,8306.T,9984.T,6758.T,8035.T,7974.T"
+WATCHLIST = [t.strip() for t in os.environ.get("STOCK_PREWARM", DEFAULT_WATCHLIST).split(",") if t.strip()]
+INTERVALS = ("1d", "5m", "1m")
+# キャッシュの TTL（1時間）より短くして、切れたものを利用者より先に作り直す
+EVERY = float(os.environ.get("STOCK_PREWARM_EVERY", "900"))
+
+_thread = None
+_lock = threading.Lock()
+
+
+def warm_store(ticker):
+    # 保存データだけを温める（アプリの外から使う）。戻り値: エラー（無ければ None）
+    errors = []
+    for interval in INTERVALS:
+        _, err = load_bars(ticker, FETCH_PERIODS[interval], interval)
+        if err: errors.append(f"{interval}: {err}")
+    return ", ".join(errors) or None
+
+
+def run_once(warm, tickers=None):
+    # warm(ticker) -> エラー or None。戻り値: 失敗した {ticker: エラー}（1銘柄の失敗で残りを止めない）
+    errors = {}
+    for ticker in tickers or WATCHLIST:
+        try:
+            with tracing.span("prewarm", ticker=ticker):
+                err = warm(ticker)
+        except Exception as e:
+            err = f"エラー: {e}"
+        if err: errors[ticker] = err
+    return errors
+
+
+def start(warm, every=EVERY):
+    """warm(ticker) をウォッチリストの全銘柄に裏のスレッドで行い、every 秒ごとに繰り返す（プロセスで1回だけ起動）。"""
+    global _thread
+    with _lock:
+        if _thread is not None or not WATCHLIST: return _thread
+
+        def loop():
+            with rate_limit.priority(rate_limit.BACKGROUND):
+                while True:
+                    run_once(warm)
+                    if every <= 0: return
+                    time.sleep(every)
+        _thread = threading.Thread(target=loop, daemon=True, name="prewarm")
+        _thread.start()
+        return _thread
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ウォッチリストの銘柄の足データを取得して保存データを温める")
+    parser.add_argument("tickers", nargs="*", help="例: 7203.T（省略時は STOCK_PREWARM / 既定のウォッチリスト）")
+    parser.add_argument("--loop", action="store_true", help="終わったあとも --every 秒ごとに繰り返す")
+    parser.add_argument("--every", type=float, default=EVERY)
+    args = parser.parse_args()
+    while True:
+        t0 = time.perf_counter()
+        errors = run_once(warm_store, args.tickers or None)
+        print(f"{len(args.tickers or WATCHLIST) - len(errors)} 銘柄を温めました（{time.perf_counter() - t0:.1f} 秒）")
+        if errors: print(f"失敗 {len(errors)} 件: " + ", ".join(f"{t}（{e}）" for t, e in errors.items()))
+        if not args.loop: break
+        time.sleep(args.every)
@@ -0,0 +1,197 @@
+import contextvars
+import functools
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import tracing
+
+# === 取得元（上流ホスト）ごとの流量制限と、優先度付きの順番待ち ===
+# yfinance・Yahoo!ファイナンスへの取得は、全セッション合わせてホストごとのトークンバケットで絞る。
+# 枠が空くのを待つ間は優先度の高い順（同じ優先度なら先着順）に通す:
+#   MAIN（メインチャート）> META（日付選択）> SUB（サブチャートの足・銘柄名）> BACKGROUND（裏での先読み）
+# 優先度は priority(...) / prioritized(...) で呼び出し側が指定し、contextvars で取得処理まで伝わる（既定は MAIN）。
+# - 429 などで絞られたら、そのホストは間隔を倍々に空けて（backoff）待たせる。成功すれば元に戻す
+# - 待ち行列はホストごとに上限付き。溢れたら優先度の一番低いものを諦めさせる
+# - 制限はプロセス単位。複数プロセスで動かすときは STOCK_RATE_PROCESSES にプロセス数を入れて頭割りにする
+MAIN, META, SUB, BACKGROUND = 0, 1, 2, 3
+PRIORITY_NAMES = {MAIN: "main", META: "meta", SUB: "sub", BACKGROUND: "background"}
+
+YF_HOST = "query2.finance.yahoo.com"
+# ホスト -> (1秒あたりの回数, 続けて出せる回数)
+RATES = {YF_HOST: (2.0, 4), "finance.yahoo.co.jp": (2.0, 4)}
+DEFAULT_RATE = (4.0, 8)
+PROCESSES = max(1, int(os.environ.get("STOCK_RATE_PROCESSES", "1")))
+MAX_QUEUE = 32
+QUEUE_WAIT = 20
+BACKOFF = 2
+BACKOFF_MAX = 120
+
+_priority = contextvars.ContextVar("upstream_priority", default=MAIN)
+_seq = itertools.count()
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+class Bucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.blocked_until = 0.0
+        self.strikes = 0
+        self.waiting = []  # [優先度, 到着順, 状態] のヒープ。状態: None=待ち / False=追い出された
+        self.cond = threading.Condition()
+        self.stats = {"granted": 0, "rejected": 0, "throttled": 0}
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def _remove(self, entry):
+        self.waiting.remove(entry)
+        heapq.heapify(self.waiting)
+        self.cond.notify_all()
+
+    def acquire(self, priority, timeout):
+        # 戻り値: 取得してよいか（待ちすぎ・追い出されたら False）
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            if len(self.waiting) >= MAX_QUEUE:
+                worst = max(self.waiting)
+                if worst[0] <= priority:
+                    self.stats["rejected"] += 1
+                    return False
+                worst[2] = False
+                self._remove(worst)
+            entry = [priority, next(_seq), None]
+            heapq.heappush(self.waiting, entry)
+            while True:
+                if entry[2] is False:
+                    self.stats["rejected"] += 1
+                    return False
+                now = time.monotonic()
+                self._refill(now)
+                head = self.waiting[0] is entry
+                if head and now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    heapq.heappop(self.waiting)
+                    self.cond.notify_all()
+                    self.stats["granted"] += 1
+                    return True
+                if now >= deadline:
+                    self._remove(entry)
+                    self.stats["rejected"] += 1
+                    return False
+                # 先頭は次のトークン（または backoff 明け）まで、それ以外は先頭が通るまで寝る
+                wake = max(self.blocked_until - now, (1 - self.tokens) / self.rate, 0.01) if head else deadline - now
+                self.cond.wait(min(wake, deadline - now))
+
+    def throttled(self):
+        with self.cond:
+            self.strikes += 1
+            self.stats["throttled"] += 1
+            self.blocked_until = time.monotonic() + min(BACKOFF_MAX, BACKOFF * 2 ** (self.strikes - 1))
+            self.tokens = 0
+            self.cond.notify_all()
+
+    def ok(self):
+        with self.cond:
+            self.strikes = 0
+
+    def depth(self):
+        with self.cond:
+            counts = dict.fromkeys(PRIORITY_NAMES.values(), 0)
+            for entry in self.waiting:
+                counts[PRIORITY_NAMES[entry[0]]] += 1
+            return counts
+
+
+def bucket(host):
+    with _buckets_lock:
+        if host not in _buckets:
+            rate, burst = RATES.get(host, DEFAULT_RATE)
+            _buckets[host] = Bucket(rate / PROCESSES, max(1, burst // PROCESSES))
+        return _buckets[host]
+
+
+def reset():
+    # 設定（RATES など）を変えたあとに作り直す
+    with _buckets_lock:
+        _buckets.clear()
+
+
+@contextmanager
+def priority(level):
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def prioritized(level, fn):
+    # 別スレッドに渡す関数などに優先度を付ける
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with priority(level):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def current_priority():
+    return _priority.get()
+
+
+def acquire(host, timeout=QUEUE_WAIT):
+    # 1回分の取得の許可を待つ。戻り値: 取得してよいか（False なら呼び出し側は取得せずにエラーを返す）
+    level = _priority.get()
+    with tracing.span("rate.wait", host=host, priority=PRIORITY_NAMES[level]):
+        got = bucket(host).acquire(level, timeout)
+        tracing.note(acquired=got)
+    return got
+
+
+def throttled(host):
+    bucket(host).throttled()
+
+
+def ok(host):
+    bucket(host).ok()
+
+
+def depth():
+    # ホスト -> {優先度: 待っている数}
+    with _buckets_lock:
+        items = list(_buckets.items())
+    return {host: b.depth() for host, b in items}
+
+
+def report():
+    rows = []
+    with _buckets_lock:
+        items = sorted(_buckets.items())
+    for host, b in items:
+        with b.cond:
+            backoff = max(0.0, b.blocked_until - time.monotonic())
+            stats = dict(b.stats)
+        rows.append(dict({"host": host, "backoff_s": round(backoff, 1)}, **b.depth(), **stats))
+    return rows
+
+
+def prometheus_lines(p):
+    out = [f"# HELP {p}_upstream_queue_depth 上流への取得の順番待ち", f"# TYPE {p}_upstream_queue_depth gauge"]
+    for host, counts in sorted(depth().items()):
+        out += [f'{p}_upstream_queue_depth{{host="{host}",priority="{name}"}} {n}' for name, n in counts.items()]
+    out += [f"# HELP {p}_upstream_requests_total 上流への取得の許可・見送り・被制限", f"# TYPE {p}_upstream_requests_total counter"]
+    for row in report():
+        out += [f'{p}_upstream_requests_total{{host="{row["host"]}",result="{k}"}} {row[k]}'
+                for k in ("granted", "rejected", "throttled")]
+    return out
+
+
+tracing.add_metrics(prometheus_lines)
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+# === 足の集約（yfinanceへ別途取りに行かず、手元の細かい足から作る） ===
+# interval -> 集約元の interval
+SOURCE_INTERVAL = {"3m": "1m", "5m": "1m", "15m": "1m", "30m": "1m", "1wk": "1d", "1mo": "1d"}
+
+MINUTE_WIDTHS = {"3m": 3, "5m": 5, "15m": 15, "30m": 30}
+
+# 東証の前場・後場の開始（0:00からの分）。分足の区切りは各セッションの開始時刻を起点に揃え、
+# 昼休みをまたぐ足は作らない
+SESSION_START_MINUTES = np.array([0, 9 * 60, 12 * 60 + 30])
+
+
+def bucket_keys(index, interval):
+    day = index.normalize()
+    if interval in MINUTE_WIDTHS:
+        width = MINUTE_WIDTHS[interval]
+        minutes = np.asarray((index - day) // pd.Timedelta(minutes=1))
+        session = SESSION_START_MINUTES[np.searchsorted(SESSION_START_MINUTES, minutes, side='right') - 1]
+        start = session + (minutes - session) // width * width
+        return day + pd.to_timedelta(start, unit='min')
+    if interval == "1d":
+        return day
+    if interval == "1wk":
+        # yfinance の週足と同じく、その週の月曜日の日付をラベルにする
+        return day - pd.to_timedelta(index.dayofweek, unit='D')
+    if interval == "1mo":
+        return day - pd.to_timedelta(index.day - 1, unit='D')
+    raise ValueError(f"未対応の足種: {interval}")
+
+
+def resample_ohlcv(df, interval):
+    g = df.groupby(bucket_keys(df.index, interval), sort=True)
+    out = pd.DataFrame({
+        'Open': g['Open'].first(),
+        'High': g['High'].max(),
+        'Low': g['Low'].min(),
+        'Close': g['Close'].last(),
+        'Volume': g['Volume'].sum(),
+    })
+    if 'Adj Close' in df.columns:
+        out['Adj Close'] = g['Adj Close'].last()
+    out.index.name = df.index.name
+    return out.dropna(subset=['Open', 'Close'])
+
+
+def decimate_ohlcv(df, old, width):
+    # 先頭 old 本（古い履歴）を本数で最大 width 本にまとめ、残りはそのまま返す。戻り値: (df, まとめた後の本数)
+    # ローソク足の形が崩れないよう 始値=最初・高値=最大・安値=最小・終値=最後、
+    # ほかの列（指標など）は終値と同じく最後の値、時刻は最初の足のものを使う
+    if old <= width: return df, old
+    k = -(-old // width)
+    starts = np.arange(0, old, k)
+    ends = np.append(starts[1:], old) - 1
+    head = {}
+    for col in df.columns:
+        v = df[col].to_numpy()
+        if col == 'Open': head[col] = v[starts]
+        elif col == 'High': head[col] = np.maximum.reduceat(v[:old], starts)
+        elif col == 'Low': head[col] = np.minimum.reduceat(v[:old], starts)
+        elif col == 'Volume': head[col] = np.add.reduceat(v[:old], starts)
+        else: head[col] = v[ends]
+    head = pd.DataFrame(head, index=df.index[starts])
+    return pd.concat([head, df.iloc[old:]]), len(starts)
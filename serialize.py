@@ -0,0 +1,117 @@
+import base64
+import json
+import zlib
+import numpy as np
+import pandas as pd
+from resample import bucket_keys
+
+# === チャート用データの整形（iterrows を使わず列単位で変換する） ===
+# 送信形式（1系列あたり）:
+#   {"n": 本数, "tu": 時刻の単位秒(分足=1, 日足以上=86400), "pd": 価格の小数桁,
+#    "t": 時刻, "o"/"h"/"l"/"c": 価格, "v": 出来高,
+#    "ind": {指標列: 値}, "ld": {指標列: 小数桁}}
+# 時刻・価格・指標は整数化したうえで差分（先頭は絶対値）にして送る。JS側で累積和して戻す。
+# 出来高は差分にしても縮まないのでそのまま整数で送る。
+PRICE_KEYS = {'o': 'Open', 'h': 'High', 'l': 'Low', 'c': 'Close'}
+
+# 呼値の候補（小数桁）。分割調整で端数が出る銘柄もあるので、割り切れる一番粗い桁を選ぶ
+MAX_PRICE_DECIMALS = 3
+
+# これより大きいペイロードは deflate + base64 で送る（JS側は DecompressionStream で展開。game_component/frontend/decode.js）
+COMPRESS_MIN_BYTES = 16 * 1024
+# 圧縮レベル。9 は 6 の倍以上遅いのにほとんど縮まない（日付を変えるたびに圧縮し直すので速さを優先）
+COMPRESS_LEVEL = 6
+
+
+def chart_seconds(index):
+    # JSTの時刻をそのままあえてUTCとしてTimestamp化することで
+    # Lightweight Charts (デフォルトUTC表示) で見たときに
+    # 日本時間通りの時刻 (09:00など) が表示されるようにするトリック
+    # index は Naive (JST時刻が入っている) なので、そのままエポック秒にすればよい
+    return index.values.astype('datetime64[s]').astype(np.int64)
+
+
+def price_decimals(df):
+    vals = df[list(PRICE_KEYS.values())].to_numpy(dtype=float).ravel()
+    vals = vals[np.isfinite(vals)]
+    for dec in range(MAX_PRICE_DECIMALS + 1):
+        scaled = vals * 10 ** dec
+        if np.all(np.abs(scaled - np.round(scaled)) < 1e-6):
+            return dec
+    return MAX_PRICE_DECIMALS
+
+
+def _delta(ints):
+    return np.diff(ints, prepend=0).tolist()
+
+
+def _quantize(values, decimals):
+    return np.round(np.asarray(values, dtype=float) * 10 ** decimals).astype(np.int64)
+
+
+def line_decimals(scale, price_dec):
+    # 価格スケールの線は呼値より1桁細かく持つ（線のガタつき防止）
+    return {'price': price_dec + 1, 'volume': 0, 'osc': 2}[scale]
+
+
+def serialize_chart(df, is_intraday, lines, with_volume=True):
+    tu = 1 if is_intraday else 86400
+    dec = price_decimals(df)
+    out = {"n": len(df), "tu": tu, "pd": dec, "t": _delta(chart_seconds(df.index) // tu)}
+    for key, col in PRICE_KEYS.items():
+        out[key] = _delta(_quantize(df[col].values, dec))
+    if with_volume:
+        out["v"] = np.round(df['Volume'].to_numpy(dtype=float)).astype(np.int64).tolist()
+    out["ind"], out["ld"] = {}, {}
+    for line in lines:
+        ld = line_decimals(line["scale"], dec)
+        out["ind"][line["key"]] = _delta(_quantize(df[line["key"]].values, ld))
+        out["ld"][line["key"]] = ld
+    return out
+
+
+def serialize_forming(main_df, ctx_index, tgt_index, sub_index, sub_interval, is_sub_intraday, n_offset=0):
+    # メインの各ステップ（ctx末尾 + tgt を1本ずつ表示した時点）について、サブチャートの
+    # 確定足の本数 n と形成中の足（同じサブ足に属するメイン足の累積OHLC）を前計算する。
+    # JS側は毎ターン表を引くだけでよい。n はステップ0から、形成中の足はステップ s0 から。
+    # ctx が空のとき（s0 = 1）、ステップ0はまだ何も出していないので、tgt 1本目のサブ足より前の確定足だけ
+    # n_offset: サブチャートの古い履歴をまとめて送る場合に減った本数（n から引く）
+    steps = ctx_index[-1:].append(tgt_index)
+    s0 = 0 if len(ctx_index) else 1
+    if len(steps) == 0:
+        return {"s0": s0, "n": [], "tu": 1, "pd": 0, "t": [], "o": [], "h": [], "l": [], "c": []}
+    # 最初のステップが属するサブ足の開始から最後のステップまでだけを集計すればよい
+    first_bucket = bucket_keys(steps[:1], sub_interval)[0]
+    main_df = main_df.iloc[main_df.index.searchsorted(first_bucket, side='left'):
+                           main_df.index.searchsorted(steps[-1], side='right')]
+
+    keys = bucket_keys(main_df.index, sub_interval)
+    g = main_df.groupby(keys, sort=False)
+    form = pd.DataFrame({
+        'Open': g['Open'].transform('first').values,
+        'High': g['High'].cummax().values,
+        'Low': g['Low'].cummin().values,
+        'Close': main_df['Close'].values,
+    }, index=main_df.index)
+
+    pos = main_df.index.get_indexer(steps)
+    form = form.iloc[pos]
+    buckets = keys[pos]
+    # 確定足: サブ足の time < 形成中の足の開始
+    n = sub_index.searchsorted(buckets, side='left') - n_offset
+    if s0: n = np.concatenate([n[:1], n])
+
+    tu = 1 if is_sub_intraday else 86400
+    dec = price_decimals(form)
+    out = {"s0": s0, "n": _delta(n), "tu": tu, "pd": dec, "t": _delta(chart_seconds(buckets) // tu)}
+    for key, col in PRICE_KEYS.items():
+        out[key] = _delta(_quantize(form[col].values, dec))
+    return out
+
+
+def pack_payload(obj, compress=True):
+    raw = json.dumps(obj, separators=(',', ':'))
+    if not compress or len(raw) < COMPRESS_MIN_BYTES:
+        return raw
+    return json.dumps({"z": base64.b64encode(zlib.compress(raw.encode('utf-8'), COMPRESS_LEVEL)).decode('ascii')})
+
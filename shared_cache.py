@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import tracing
+
+try:
+    import fcntl
+except ImportError:
+    # Windows など。プロセス間のロックは無しで、プロセス内のロックだけ効かせる
+    fcntl = None
+
+# === プロセス間で共有するキャッシュ（ローカルディスク） ===
+# ロードバランサの後ろで複数の Streamlit プロセスを動かす前提。
+# - file_lock(key): 同じ key の処理はプロセス・スレッドをまたいで1つずつ（single-flight）。
+#   待っていた側は、先に終わった処理が残した結果（保存データ・このキャッシュ）を使う
+# - memoize(key, fn): fn() -> (value, err) の結果を JSON でディスクに TTL 付きで保存する
+# ロックは flock なので、持ったままプロセスが落ちても OS が外す。待ちすぎたらロック無しで進む
+# 検索語のようにキーが際限なく増えるので、put のついでに PRUNE_EVERY 秒に1回、期限切れの値と
+# 使われていないロックのファイルを消す
+SHARED_DIR = os.environ.get(
+    "STOCK_SHARED_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "shared"),
+)
+LOCK_WAIT = 30
+LOCK_POLL = 0.05
+PRUNE_EVERY = 3600
+
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+_pruned_at = 0.0
+_prune_lock = threading.Lock()
+
+
+def key_name(key):
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:20]
+
+
+def _thread_lock(name):
+    with _thread_locks_lock:
+        return _thread_locks.setdefault(name, threading.Lock())
+
+
+def _flock(path, deadline):
+    # 戻り値: ロックしたファイル（取れなければ None）
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        f = open(path, 'a')
+    except OSError:
+        return None
+    while True:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if _same_file(f, path): return f
+            # 待っている間に prune で消された。作り直したファイルでロックし直す
+            f.close()
+            f = open(path, 'a')
+            continue
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                f.close()
+                return None
+            time.sleep(LOCK_POLL)
+        except OSError:
+            f.close()
+            return None
+
+
+def _same_file(f, path):
+    try:
+        return os.path.samestat(os.fstat(f.fileno()), os.stat(path))
+    except OSError:
+        return False
+
+
+@contextmanager
+def file_lock(key, timeout=LOCK_WAIT):
+    # 戻り値（as の値）: ロックが取れたか
+    name = key_name(key)
+    deadline = time.monotonic() + timeout
+    tlock = _thread_lock(name)
+    with tracing.span("lock.wait", key=str(key)[:60]):
+        got_thread = tlock.acquire(timeout=timeout)
+        f = None
+        if got_thread and fcntl is not None:
+            f = _flock(os.path.join(SHARED_DIR, "locks", f"{name}.lock"), deadline)
+        got = got_thread and (fcntl is None or f is not None)
+        tracing.note(acquired=got)
+    try:
+        yield got
+    finally:
+        if f is not None:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+        if got_thread: tlock.release()
+
+
+def _value_path(key):
+    return os.path.join(SHARED_DIR, "values", f"{key_name(key)}.json")
+
+
+def get(key):
+    # 戻り値: (ヒットしたか, 値, 残りの有効秒数)
+    try:
+        with open(_value_path(key), encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return False, None, 0
+    left = entry.get("expires", 0) - time.time()
+    if entry.get("key") != repr(key) or left <= 0: return False, None, 0
+    return True, entry["value"], left
+
+
+def put(key, value, ttl):
+    path = _value_path(key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"key": repr(key), "expires": time.time() + ttl, "value": value}, ensure_ascii=False))
+        os.replace(tmp, path)
+    except (OSError, TypeError, ValueError):
+        # 書けない環境・JSON にできない値はプロセス内のキャッシュだけで我慢する
+        pass
+    maybe_prune()
+
+
+def maybe_prune(now=None):
+    # PRUNE_EVERY 秒に1回だけ prune する（プロセスごと）
+    global _pruned_at
+    now = time.time() if now is None else now
+    with _prune_lock:
+        if now - _pruned_at < PRUNE_EVERY: return
+        _pruned_at = now
+    prune(now)
+
+
+def prune(now=None):
+    # 期限切れの値・書きかけのまま残った一時ファイル・誰も持っていないロックを消す。戻り値: 消した数
+    now = time.time() if now is None else now
+    removed = 0
+    values = os.path.join(SHARED_DIR, "values")
+    for name in _listdir(values):
+        path = os.path.join(values, name)
+        try:
+            if name.endswith(".tmp"):
+                if now - os.path.getmtime(path) < PRUNE_EVERY: continue
+            else:
+                with open(path, encoding='utf-8') as f:
+                    if json.load(f).get("expires", 0) > now: continue
+            os.remove(path)
+            removed += 1
+        except (OSError, ValueError):
+            pass
+    if fcntl is None: return removed
+    locks = os.path.join(SHARED_DIR, "locks")
+    for name in _listdir(locks):
+        path = os.path.join(locks, name)
+        try:
+            with open(path, 'a') as f:
+                # 持っているプロセスがいれば残す。取れたものは持ったまま消す（待っていた側は _flock で作り直す）
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                if _same_file(f, path):
+                    os.remove(path)
+                    removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def _listdir(path):
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+
+def memoize(key, fn, ttl, fail_ttl):
+    """fn() -> (value, err) の結果をプロセス間で共有し、(value, 残りの有効秒数) を返す。同じ key の fn は同時に1つだけ動かす。"""
+    hit, value, left = get(key)
+    if hit: return value, left
+    with file_lock(key):
+        # 待っている間に他のプロセスが済ませていればそれを使う
+        hit, value, left = get(key)
+        if hit: return value, left
+        value, err = fn()
+        left = ttl if err is None else fail_ttl
+        put(key, value, left)
+    return value, left
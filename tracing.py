@@ -0,0 +1,218 @@
+import contextvars
+import functools
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# === 計測（ページ表示の各段階のスパン） ===
+# with span("名前", 属性=...) で区間の時間を測る。ページごとの trace に積み、
+# - デバッグ表示（app.py の ?debug=1）
+# - JSON Lines のログ（STOCK_TRACE_LOG にパスを指定したときだけ、1行 = 1ページ）
+# - Prometheus 形式の集計（STOCK_METRICS_PORT を指定すると /metrics で公開）
+# に使う。キャッシュ付き関数は traced(cached=True) で包み、本体が実行されたら miss() で印を付ける
+TRACE_LOG = os.environ.get("STOCK_TRACE_LOG")
+METRIC_PREFIX = "stock"
+
+_trace = contextvars.ContextVar("trace", default=None)
+_span = contextvars.ContextVar("span", default=None)
+_ids = itertools.count(1)
+_stats = {}  # スパン名 -> 集計
+_stats_lock = threading.Lock()
+_log_lock = threading.Lock()
+_server = None  # /metrics のサーバー（公開できなかったら False）
+_metric_sources = []  # prometheus_text に足す行を返す関数（引数: 接頭辞）
+
+
+class Trace:
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def to_dict(self):
+        return {"trace": self.id, "name": self.name, "started": round(self.started, 3),
+                "ms": round((time.perf_counter() - self.t0) * 1e3, 2), "spans": list(self.spans)}
+
+
+def start_trace(name="page"):
+    # 前のページの trace が終わっていなければ捨てて始め直す
+    tr = Trace(name)
+    _trace.set(tr)
+    _span.set(None)
+    return tr
+
+
+def current():
+    return _trace.get()
+
+
+def finish_trace():
+    tr = _trace.get()
+    if tr is None: return None
+    _trace.set(None)
+    if TRACE_LOG:
+        line = json.dumps(tr.to_dict(), ensure_ascii=False, default=str)
+        try:
+            with _log_lock, open(TRACE_LOG, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+        except OSError:
+            pass
+    return tr
+
+
+@contextmanager
+def span(name, cached=False, **attrs):
+    parent = _span.get()
+    rec = {"id": next(_ids), "parent": parent["id"] if parent else None, "name": name, "attrs": attrs}
+    if cached: attrs["cache"] = "hit"
+    token = _span.set(rec)
+    t0 = time.perf_counter()
+    try:
+        yield rec
+    except Exception as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        dt = time.perf_counter() - t0
+        _span.reset(token)
+        tr = _trace.get()
+        if tr is not None:
+            rec["start_ms"] = round((t0 - tr.t0) * 1e3, 2)
+            rec["ms"] = round(dt * 1e3, 2)
+            with tr.lock:
+                tr.spans.append(rec)
+        _record(name, dt, attrs)
+
+
+def note(**attrs):
+    # 実行中のスパンに属性を足す（ペイロードのバイト数など）
+    rec = _span.get()
+    if rec is not None: rec["attrs"].update(attrs)
+
+
+def miss():
+    # キャッシュ付き関数の本体から呼ぶ（本体が動いた = キャッシュミス）
+    note(cache="miss")
+
+
+def traced(name=None, cached=False):
+    def deco(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(label, cached=cached, args=", ".join(map(str, args))[:80]):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def bind(fn):
+    # 別スレッドで実行する関数に、呼び出し元の trace / スパンを引き継ぐ
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+
+def _record(name, dt, attrs):
+    with _stats_lock:
+        s = _stats.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0, "hit": 0, "miss": 0, "errors": 0, "bytes": 0})
+        s["count"] += 1
+        s["sum"] += dt
+        s["max"] = max(s["max"], dt)
+        if attrs.get("cache") in ("hit", "miss"): s[attrs["cache"]] += 1
+        if "error" in attrs: s["errors"] += 1
+        if isinstance(attrs.get("bytes"), int): s["bytes"] += attrs["bytes"]
+
+
+def stats():
+    with _stats_lock:
+        return {k: dict(v) for k, v in _stats.items()}
+
+
+def trace_rows(tr):
+    # デバッグ表示用: 親の直後に子を開始順で並べ、親子関係は名前の字下げで表す
+    if tr is None: return []
+    with tr.lock:
+        spans = sorted(tr.spans, key=lambda r: r["start_ms"])
+    ids = {r["id"] for r in spans}
+    children = {}
+    for r in spans:
+        children.setdefault(r["parent"] if r["parent"] in ids else None, []).append(r)
+    rows = []
+
+    def walk(parent, depth):
+        for r in children.get(parent, []):
+            rows.append({"span": "　" * depth + r["name"], "start_ms": r["start_ms"], "ms": r["ms"], **r["attrs"]})
+            walk(r["id"], depth + 1)
+    walk(None, 0)
+    return rows
+
+
+def prometheus_text():
+    p = METRIC_PREFIX
+    out = [f"# HELP {p}_span_seconds 各段階の所要時間", f"# TYPE {p}_span_seconds summary"]
+    data = stats()
+    for name, s in sorted(data.items()):
+        out.append(f'{p}_span_seconds_count{{span="{name}"}} {s["count"]}')
+        out.append(f'{p}_span_seconds_sum{{span="{name}"}} {s["sum"]:.6f}')
+    out += [f"# HELP {p}_span_seconds_max 各段階の最大所要時間", f"# TYPE {p}_span_seconds_max gauge"]
+    out += [f'{p}_span_seconds_max{{span="{name}"}} {s["max"]:.6f}' for name, s in sorted(data.items())]
+    out += [f"# HELP {p}_cache_requests_total キャッシュ付き関数の呼び出し", f"# TYPE {p}_cache_requests_total counter"]
+    for name, s in sorted(data.items()):
+        if s["hit"] or s["miss"]:
+            out.append(f'{p}_cache_requests_total{{span="{name}",result="hit"}} {s["hit"]}')
+            out.append(f'{p}_cache_requests_total{{span="{name}",result="miss"}} {s["miss"]}')
+    out += [f"# HELP {p}_span_errors_total 例外で終わったスパン", f"# TYPE {p}_span_errors_total counter"]
+    out += [f'{p}_span_errors_total{{span="{name}"}} {s["errors"]}' for name, s in sorted(data.items())]
+    out += [f"# HELP {p}_span_bytes_total スパンで扱ったバイト数（ペイロード・HTTP応答）", f"# TYPE {p}_span_bytes_total counter"]
+    out += [f'{p}_span_bytes_total{{span="{name}"}} {s["bytes"]}' for name, s in sorted(data.items()) if s["bytes"]]
+    for source in _metric_sources:
+        out += source(p)
+    return "\n".join(out) + "\n"
+
+
+def add_metrics(source):
+    # 他のモジュールの指標（待ち行列の長さなど）を /metrics に載せる
+    if source not in _metric_sources: _metric_sources.append(source)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_metrics(port, host="0.0.0.0"):
+    # /metrics を別スレッドで公開する（プロセス内で1回だけ）
+    # 同じホストの別プロセスが先にポートを使っていれば（複数プロセス構成）、警告を1回出して公開しない。
+    # 戻り値: サーバー（公開できなければ None）
+    global _server
+    with _stats_lock:
+        if _server is not None: return _server or None
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            _server = False
+            logging.getLogger(__name__).warning("/metrics を公開できません（ポート %s）: %s", port, e)
+            return None
+    threading.Thread(target=_server.serve_forever, daemon=True, name="metrics").start()
+    return _server